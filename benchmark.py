@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from common.functions import function_type
+from common.problem_type import problem_type
+from common.reader import load_dataset_pair
+from perceptron import MLP
+from start_async_tests import HIDDEN_LAYERS, LEARINN_RATE, SEED
+
+BASELINE_PATH = 'data/benchmarks/baseline.json'
+SIZES = [100, 1000, 10000]
+DATASETS = {
+    problem_type.Classification: 'data/classification/data.simple.{}.{}.csv',
+    problem_type.Regression: 'data/regression/data.cube.{}.{}.csv',
+}
+MNIST_LAYERS = [28 * 28, 512, 10]
+MNIST_SAMPLES = 2000
+OPERATIONS = ['feed_forward', 'backpropagation', 'train_epoch', 'test', 'predict_list']
+
+
+def measure(function, samples, repeat=3, min_time=0.05):
+    """
+    Times function (which processes samples rows per call) and the memory it allocates.
+
+    Returns:
+        dict with the best time per call out of repeat rounds, the throughput and the peak allocation
+    """
+    function()
+    best = np.inf
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / calls)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': best, 'samples_per_second': samples / best, 'peak_kb': peak / 1024}
+
+
+def benchmark_model(model, dataset, repeat=3, min_time=0.05):
+    """
+    Runs every operation of OPERATIONS on the model, returns a dict operation -> measurement.
+    """
+    X, Y = model.prepare_training_data(dataset, category_shift=1)
+    X_batch, Y_batch = X[:model.batch_size], Y[:model.batch_size]
+    outputs = model.feed_forward(X_batch)
+    results = {}
+    results['feed_forward'] = measure(lambda: model.feed_forward(X_batch), len(X_batch), repeat, min_time)
+    results['backpropagation'] = measure(
+        lambda: model.backpropagation(outputs[0], outputs[1], Y_batch), len(X_batch), repeat, min_time)
+    results['train_epoch'] = measure(lambda: model.train(dataset, -1, shuffle=False), len(X), repeat, min_time)
+    test_inputs, _ = dataset
+    results['test'] = measure(lambda: model.test(dataset, -1), len(test_inputs), repeat, min_time)
+    results['predict_list'] = measure(lambda: model.predict_list(test_inputs), len(test_inputs), repeat, min_time)
+    return results
+
+
+def make_model(p_type, layers, batch_size=1, dtype=np.float64):
+    if p_type == problem_type.Classification:
+        output_function, loss_function = function_type.Softmax, function_type.Cross_entropy
+    else:
+        output_function, loss_function = function_type.Indentity, function_type.MSE
+    return MLP(p_type, layers, function_type.Sigmoid, output_function, loss_function, 1, LEARINN_RATE, SEED,
+               True, batch_size, dtype)
+
+
+def synthetic_mnist(samples=MNIST_SAMPLES, seed=SEED):
+    """
+    Random images and labels with the shapes and dtype of mnist.py.
+    """
+    random = np.random.RandomState(seed)
+    X = random.randint(0, 256, (samples, MNIST_LAYERS[0])).astype(np.float32) / 255
+    y = random.randint(0, MNIST_LAYERS[-1], samples) + 1
+    return X, y
+
+
+def run_benchmarks(sizes=SIZES, hidden_layers=HIDDEN_LAYERS, mnist=True, batch_size=1, repeat=3, min_time=0.05,
+                   verbose=True):
+    """
+    Returns a dict "operation/case" -> measurement, cases are named problem/hidden layers/rows or mnist.
+    """
+    results = {}
+
+    def record(case, model, dataset):
+        for operation, measurement in benchmark_model(model, dataset, repeat, min_time).items():
+            results[f'{operation}/{case}'] = measurement
+            if verbose:
+                print(f'{operation}/{case}: {measurement["samples_per_second"]:.0f} samples/s, '
+                      f'{measurement["peak_kb"]:.0f} KB')
+
+    for p_type, pattern in DATASETS.items():
+        for size in sizes:
+            train_dataset, _ = load_dataset_pair(p_type, pattern.format('train', size), pattern.format('test', size))
+            inputs = train_dataset[0].shape[1]
+            outputs = len(np.unique(train_dataset[1])) if p_type == problem_type.Classification else 1
+            for hidden in hidden_layers:
+                layers = [inputs] + list(hidden) + [outputs]
+                case = f'{p_type.__name__}/{"-".join(map(str, hidden)) or "none"}/{size}'
+                record(case, make_model(p_type, layers, batch_size), train_dataset)
+    if mnist:
+        model = make_model(problem_type.Classification, MNIST_LAYERS, batch_size, np.float32)
+        record('mnist/synthetic', model, synthetic_mnist())
+    return results
+
+
+def environment():
+    return {
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(results, file_path, settings):
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    with open(file_path, 'w') as f:
+        json.dump({'environment': environment(), 'settings': settings, 'results': results}, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Returns a list of (name, baseline throughput, throughput, change) for every benchmark
+    whose throughput dropped more than threshold (a fraction) below the baseline.
+    """
+    regressions = []
+    for name, measurement in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['samples_per_second']
+        after = measurement['samples_per_second']
+        change = after / before - 1
+        if change < -threshold:
+            regressions.append((name, before, after, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the hot paths of MLP and compares them with a baseline. '
+                                                 'Pin BLAS to one thread (OMP_NUM_THREADS=1) for stable numbers.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--max-topologies', type=int, default=len(HIDDEN_LAYERS),
+                        help='benchmark only the first N hidden layer configurations')
+    parser.add_argument('--no-mnist', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-time', type=float, default=0.05)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--output', default=None, help='also write the results to this file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed throughput drop, 0.1 = 10%%')
+    args = parser.parse_args()
+
+    settings = {'sizes': args.sizes, 'max_topologies': args.max_topologies, 'mnist': not args.no_mnist,
+                'batch_size': args.batch_size, 'repeat': args.repeat, 'min_time': args.min_time}
+    results = run_benchmarks(args.sizes, HIDDEN_LAYERS[:args.max_topologies], not args.no_mnist, args.batch_size,
+                             args.repeat, args.min_time)
+    if args.output is not None:
+        save_results(results, args.output, settings)
+    if args.save:
+        save_results(results, args.baseline, settings)
+        print(f'Saved baseline to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print('Warning: the baseline was recorded with different settings')
+        regressions = compare(results, baseline['results'], args.threshold)
+        for name, before, after, change in regressions:
+            print(f'REGRESSION {name}: {before:.0f} -> {after:.0f} samples/s ({change:+.1%})')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold:.0%} of {args.baseline}')
+    else:
+        print(f'No baseline at {args.baseline}, run with --save to create it')
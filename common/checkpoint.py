@@ -0,0 +1,145 @@
+import json
+import os
+import numpy as np
+from common.functions import function_by_name
+from common.optimizers import optimizer_state, restore_optimizer
+from common.problem_type import problem_type
+from perceptron import MLP
+
+# File layout: MAGIC, 8-byte little-endian header length, JSON header, then every array
+# stored raw at an ALIGNMENT-aligned offset listed in the header, so it can be memory mapped.
+MAGIC = b'MLPCKPT1'
+ALIGNMENT = 64
+
+
+def aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def model_state(model):
+    return {
+        'problem_type': model.problem_type.value,
+        'layers': [int(layer) for layer in model.layers],
+        'activation_function': model.activation_function.__name__,
+        'output_function': model.output_function.__name__,
+        'loss_function': model.loss_function.__name__ if model.loss_function is not None else None,
+        'epochs': model.epochs,
+        'learning_rate': model.learning_rate,
+        'bias': bool(model.bias),
+        'batch_size': model.batch_size,
+        'dtype': model.dtype.str,
+        'epoch': model.epoch,
+    }
+
+
+def random_state(state):
+    """
+    Splits a numpy RNG state (np.random.get_state() or RandomState.get_state()) into
+    a JSON serializable description and its key array, see restore_random_state.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = state
+    return {'name': name, 'pos': int(pos), 'has_gauss': int(has_gauss),
+            'cached_gaussian': float(cached_gaussian)}, keys
+
+
+def restore_random_state(description, keys):
+    return (description['name'], np.asarray(keys), description['pos'], description['has_gauss'],
+            description['cached_gaussian'])
+
+
+def save_checkpoint(model, path, extra=None, arrays=None):
+    """
+    Writes the model, its parameters, the global numpy RNG state and the epoch counter.
+    The file is replaced atomically, so an interruption never leaves a broken checkpoint.
+
+    Args:
+        extra (dict): JSON serializable values stored with the checkpoint (e.g. best accuracy)
+        arrays (dict): additional arrays stored with the checkpoint (e.g. optimizer state)
+    """
+    rng, rng_keys = random_state(np.random.get_state())
+    arrays = dict(arrays or {})
+    arrays['parameters'] = model.parameters
+    arrays['rng_keys'] = rng_keys
+    header = {
+        'model': model_state(model),
+        'rng': rng,
+        'extra': extra or {},
+        'arrays': {},
+    }
+    if model.optimizer is not None:
+        header['optimizer'], optimizer_arrays = optimizer_state(model.optimizer)
+        for name, array in optimizer_arrays.items():
+            arrays[f'optimizer.{name}'] = array
+    # offsets are relative to the start of the data section
+    offset = 0
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        header['arrays'][name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        offset = aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode()
+    data_start = aligned(len(MAGIC) + 8 + len(encoded))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, 'little'))
+        f.write(encoded)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a checkpoint')
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length).decode())
+    return header, aligned(len(MAGIC) + 8 + length)
+
+
+def load_arrays(path, mmap_mode='c'):
+    """
+    Returns (header, arrays) with every array memory mapped from the file.
+    """
+    header, data_start = read_header(path)
+    arrays = {}
+    for name, info in header['arrays'].items():
+        shape = tuple(info['shape'])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, info['dtype'])
+        else:
+            arrays[name] = np.memmap(path, dtype=info['dtype'], mode=mmap_mode,
+                                     offset=data_start + info['offset'], shape=shape)
+    return header, arrays
+
+
+def load_checkpoint(path, mmap_mode='c', restore_rng=True):
+    """
+    Args:
+        mmap_mode (str): 'c' maps the parameters copy-on-write (training never writes to the file),
+            'r' maps them read-only for inference
+
+    Returns:
+        (model, header, arrays)
+    """
+    header, arrays = load_arrays(path, mmap_mode)
+    state = header['model']
+    loss_function = function_by_name(state['loss_function']) if state['loss_function'] is not None else None
+    rng_state = np.random.get_state()
+    model = MLP(problem_type(state['problem_type']), state['layers'],
+                function_by_name(state['activation_function']), function_by_name(state['output_function']),
+                loss_function, state['epochs'], state['learning_rate'], 0, state['bias'],
+                batch_size=state['batch_size'], dtype=np.dtype(state['dtype']))
+    model.bind_parameters(arrays['parameters'])
+    model.epoch = state['epoch']
+    if 'optimizer' in header:
+        prefix = 'optimizer.'
+        model.optimizer = restore_optimizer(header['optimizer'], {
+            name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)})
+    if restore_rng:
+        np.random.set_state(restore_random_state(header['rng'], arrays['rng_keys']))
+    else:
+        np.random.set_state(rng_state)
+    return model, header, arrays
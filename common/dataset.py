@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def split_dataset(dataset):
+    """
+    Returns (X, y) arrays for a dataset given either as an (X, y) pair of arrays
+    or as a list of [x, y] rows, or the inputs and labels of a PreparedDataset.
+    """
+    if isinstance(dataset, PreparedDataset):
+        return dataset.X, dataset.labels
+    if isinstance(dataset, tuple) and len(dataset) == 2 \
+            and isinstance(dataset[0], np.ndarray) and dataset[0].ndim == 2:
+        return dataset
+    X = np.array([np.asarray(x) for x, _ in dataset])
+    y = np.array([y for _, y in dataset])
+    return X, y
+
+
+class PreparedDataset:
+    """
+    Training data converted once for a model (see MLP.prepare_dataset): contiguous inputs X,
+    the labels as given and the targets Y of the network (one hot for classification).
+    batches() reshuffles it with an index permutation into a reused buffer, so every batch is a view.
+    """
+
+    def __init__(self, X, labels, Y):
+        self.X = np.ascontiguousarray(X)
+        self.labels = np.asarray(labels)
+        self.Y = np.ascontiguousarray(Y)
+        self.shuffled_X = None
+        self.shuffled_Y = None
+
+    def __len__(self):
+        return len(self.X)
+
+    def shuffle(self, permutation):
+        """
+        Returns (X, Y) in the order of the permutation, written into buffers allocated on the first call.
+        """
+        if self.shuffled_X is None:
+            self.shuffled_X = np.empty_like(self.X)
+            self.shuffled_Y = np.empty_like(self.Y)
+        np.take(self.X, permutation, axis=0, out=self.shuffled_X)
+        np.take(self.Y, permutation, axis=0, out=self.shuffled_Y)
+        return self.shuffled_X, self.shuffled_Y
+
+    def batches(self, batch_size, shuffle=True):
+        """
+        Returns the (X, Y) batch views of one epoch, in a new random order if shuffle.
+        """
+        if shuffle:
+            X, Y = self.shuffle(np.random.permutation(len(self.X)))
+        else:
+            X, Y = self.X, self.Y
+        return ((X[start:start + batch_size], Y[start:start + batch_size]) for start in range(0, len(X), batch_size))
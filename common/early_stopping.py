@@ -0,0 +1,37 @@
+class EarlyStopping:
+    """
+    Patience based early stopping on a tracked metric.
+    """
+
+    def __init__(self, patience, mode='min', min_delta=0.0):
+        """
+        Args:
+            patience (int): number of evaluations without improvement after which training stops
+            mode (str): 'min' for losses, 'max' for accuracies
+            min_delta (float): smallest change counted as an improvement
+        """
+        self.patience = patience
+        self.mode = mode
+        self.min_delta = min_delta
+        self.best = None
+        self.best_step = None
+        self.counter = 0
+
+    def improved(self, value):
+        if self.best is None:
+            return True
+        if self.mode == 'min':
+            return value < self.best - self.min_delta
+        return value > self.best + self.min_delta
+
+    def update(self, value, step=None):
+        """
+        Records the value of the metric, returns True when training should stop.
+        """
+        if self.improved(value):
+            self.best = value
+            self.best_step = step
+            self.counter = 0
+        else:
+            self.counter += 1
+        return self.counter >= self.patience
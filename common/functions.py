@@ -12,15 +12,11 @@ def indentity(x):
     return x
 
 def indentity_derivative(x):
-    return 1
-
-# def softmax(x):
-#     exps = np.exp(x - np.max(x, keepdims=True))
-#     return exps / np.sum(exps, keepdims=True)
+    return np.ones_like(x)
 
 def softmax(x):
-    exps = np.exp(x)
-    return exps / exps.sum()
+    exps = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return exps / exps.sum(axis=-1, keepdims=True)
 
 def softmax_derivative(x):
     sx = softmax(x)
@@ -36,83 +32,250 @@ def relu(x):
     return np.maximum(x, 0)
 
 def relu_derivative(x):
-    return np.array([relu_derivative_single(xi) for xi in x])
-
-def relu_derivative_single(x):
-    if x > 0:
-        return 0
-    return 1
-
-# def cross_entropy(predictions, targets, epsilon=1e-12):
-#     # predictions = np.clip(predictions, epsilon, 1. - epsilon)
-#     predictions = np.array(predictions)
-#     N = predictions.shape[0]
-#     ce = -np.sum(targets*np.log(predictions+1e-9))/N
-#     return ce
-def cross_entropy(prediction, target):
-    prediction = np.array(prediction)
-    target = np.array(target)
-    return np.mean(np.sum(-np.multiply(target, np.log(prediction + 1e-7))))
+    x = np.asarray(x)
+    return (x > 0).astype(x.dtype)
+
+def as_batch(predictions, targets):
+    """
+    Converts predictions and targets to 2-D arrays with one row per sample.
+    A 1-D array is treated as a column of single-valued samples.
+    """
+    predictions = np.asarray(predictions)
+    targets = np.asarray(targets)
+    if np.issubdtype(predictions.dtype, np.floating):
+        targets = targets.astype(predictions.dtype, copy=False)
+    return predictions.reshape(len(predictions), -1), targets.reshape(len(targets), -1)
+
+def probability_floor(predictions):
+    """
+    Clips predictions away from zero with the machine epsilon of their dtype, so that log stays finite.
+    """
+    predictions = np.asarray(predictions)
+    if not np.issubdtype(predictions.dtype, np.floating):
+        predictions = predictions.astype(np.float64)
+    return np.maximum(predictions, np.finfo(predictions.dtype).eps)
+
+def cross_entropy(predictions, targets):
+    predictions, targets = as_batch(probability_floor(predictions), targets)
+    return -np.sum(targets * np.log(predictions)) / len(targets)
+
+def cross_entropy_gradient(predictions, targets):
+    predictions, targets = as_batch(probability_floor(predictions), targets)
+    return -targets / predictions / len(targets)
+
+def softmax_cross_entropy(logits, targets):
+    """
+    Numerically stable softmax followed by cross entropy, using log-sum-exp.
+
+    Returns:
+        (loss, gradient) where gradient is taken with respect to the logits
+    """
+    logits, targets = as_batch(logits, targets)
+    shifted = logits - np.max(logits, axis=1, keepdims=True)
+    log_probabilities = shifted - np.log(np.sum(np.exp(shifted), axis=1, keepdims=True))
+    loss = -np.sum(targets * log_probabilities) / len(logits)
+    gradient = np.exp(log_probabilities)
+    gradient -= targets
+    gradient /= len(logits)
+    return loss, gradient
 
 def mse(predicteds, targets):
-    # targets = np.concatenate(targets)
-    predicteds = np.concatenate(predicteds)
-    diff = targets - predicteds
-    square = np.square(diff)
-    summation = sum(square)
-    return summation / len(targets)
+    predicteds, targets = as_batch(predicteds, targets)
+    return np.sum(np.square(targets - predicteds)) / len(targets)
+
+def mse_gradient(predicteds, targets):
+    predicteds, targets = as_batch(predicteds, targets)
+    return 2 * (predicteds - targets) / len(targets)
+
+def hinge_labels(values):
+    # replacing 2 = -1
+    return np.where(values == 2, -1, values)
 
 def hinge(predicteds, targets):
-    # replacing 0 = -1
-    new_predicted = np.array([-1 if i==2 else i for i in predicteds])
-    new_actual = np.array([-1 if i==2 else i for i in targets])
+    predicteds, targets = as_batch(predicteds, targets)
+    margins = 1 - hinge_labels(targets) * hinge_labels(predicteds)
+    return np.mean(np.maximum(margins, 0))
 
-    # calculating hinge loss
-    hinge_loss = np.mean([max(0, 1-x*y) for x, y in zip(new_actual, new_predicted)])
-    return hinge_loss
+def hinge_gradient(predicteds, targets):
+    predicteds, targets = as_batch(predicteds, targets)
+    labels = hinge_labels(targets)
+    margins = 1 - labels * hinge_labels(predicteds)
+    return np.where(margins > 0, -labels, 0) / predicteds.size
 
 def hinge_f(prediction, target):
     prediction = np.array(prediction)
     target = np.array(target)
-    Y_target_1 = np.argmax(target)
     N = prediction.shape[0]
     delta = 1.0  # A fixed margin
-    # correct_scores = prediction[np.arange(N), Y_target_1]
-
     diffs = np.maximum(0, prediction - target + delta)
-    # diffs[np.arange(N), Y_target_1] = 0
     loss = np.sum(diffs) / N
 
     return loss
 
-def msle(predictions, targets):
-    targets=np.array(targets)
-    predictions = np.concatenate(predictions)
+def msle_shift(predictions, targets):
     min = predictions.min()
     if min < 0:
-        predictions = predictions - (2*min)
-        targets = targets - (2*min)
-    log_t = np.log(targets)
-    log_p = np.log(predictions)
-    diff =  log_t - log_p
-    square = np.square(diff)
-    summation = sum(square)
-    return summation / len(targets)
+        return predictions - (2*min), targets - (2*min)
+    return predictions, targets
+
+def msle(predictions, targets):
+    predictions, targets = msle_shift(*as_batch(predictions, targets))
+    diff = np.log(targets) - np.log(predictions)
+    return np.sum(np.square(diff)) / len(targets)
+
+def msle_gradient(predictions, targets):
+    predictions, targets = as_batch(predictions, targets)
+    shifted_predictions, shifted_targets = msle_shift(predictions, targets)
+    diff = np.log(shifted_targets) - np.log(shifted_predictions)
+    gradient = -2 * diff / shifted_predictions / len(targets)
+    if predictions.min() < 0:
+        # both arrays are shifted by -2 * min, which depends on the smallest prediction
+        shift_gradient = np.sum(4 * diff * (1 / shifted_predictions - 1 / shifted_targets)) / len(targets)
+        gradient[np.unravel_index(np.argmin(predictions), predictions.shape)] += shift_gradient
+    return gradient
+
+
+class Loss:
+    """
+    Loss function working on whole batches, with its gradient with respect to the predictions.
+    """
+
+    def __init__(self, name, function, gradient):
+        self.__name__ = name
+        self.function = function
+        self.gradient = gradient
+
+    def __call__(self, predictions, targets):
+        return self.function(predictions, targets)
+
+    def value_and_gradient(self, predictions, targets):
+        return self.function(predictions, targets), self.gradient(predictions, targets)
+
+
+class Activation:
+    """
+    Activation function which computes its backward step from the cached forward output
+    instead of the pre-activation values.
+    """
+
+    def __init__(self, name, function, derivative):
+        self.__name__ = name
+        self.function = function
+        self.derivative = derivative
+
+    def __call__(self, x, out=None):
+        return self.forward(x, out)
+
+    def forward(self, x, out=None):
+        """
+        Args:
+            x (array): pre-activation values
+            out (array): optional buffer for the result, may be x itself
+        """
+        result = self.function(x)
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    def backward(self, output, grad):
+        """
+        Multiplies grad in place by the derivative of the function.
+
+        Args:
+            output (array): value returned by forward for the same layer
+            grad (array): gradient with respect to the output
+        """
+        raise NotImplementedError
+
+
+class SigmoidActivation(Activation):
+    def __init__(self):
+        super().__init__('sigmoid', sigmoid, sigmoid_derivative)
+
+    def forward(self, x, out=None):
+        out = np.negative(x, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    def backward(self, output, grad):
+        grad *= output
+        grad -= grad * output
+        return grad
+
+
+class TanhActivation(Activation):
+    def __init__(self):
+        super().__init__('tanh', tanh, tanh_derivative)
+
+    def forward(self, x, out=None):
+        return np.tanh(x, out=out)
+
+    def backward(self, output, grad):
+        grad -= grad * np.square(output)
+        return grad
+
+
+class ReluActivation(Activation):
+    def __init__(self):
+        super().__init__('relu', relu, relu_derivative)
+
+    def forward(self, x, out=None):
+        return np.maximum(x, 0, out=out)
+
+    def backward(self, output, grad):
+        grad *= output > 0
+        return grad
+
+
+class IndentityActivation(Activation):
+    def __init__(self):
+        super().__init__('indentity', indentity, indentity_derivative)
+
+    def forward(self, x, out=None):
+        if out is None or out is x:
+            return x
+        out[...] = x
+        return out
+
+    def backward(self, output, grad):
+        return grad
+
+
+class SoftmaxActivation(Activation):
+    def __init__(self):
+        super().__init__('softmax', softmax, softmax_derivative)
+
+    def forward(self, x, out=None):
+        out = np.subtract(x, np.max(x, axis=-1, keepdims=True), out=out)
+        np.exp(out, out=out)
+        out /= np.sum(out, axis=-1, keepdims=True)
+        return out
+
+    def backward(self, output, grad):
+        # full Jacobian: every output of a row depends on all of its inputs
+        grad[...] = output * (grad - np.sum(grad * output, axis=-1, keepdims=True))
+        return grad
+
+
+def function_by_name(name):
+    """
+    Returns the member of function_type with the given __name__ (e.g. 'sigmoid', 'mse').
+    """
+    for value in vars(function_type).values():
+        if getattr(value, '__name__', None) == name:
+            return value
+    raise ValueError(f'Unknown function: {name}')
 
 
 class function_type():
-    Sigmoid = sigmoid
-    Sigmoid.derivative = sigmoid_derivative
-    Indentity = indentity
-    Indentity.derivative = indentity_derivative
-    Softmax = softmax
-    Softmax.derivative = softmax_derivative
-    Tanh = tanh
-    Tanh.derivative = tanh_derivative
-    Relu = relu
-    Relu.derivative = relu_derivative
-    Cross_entropy = cross_entropy
-    MSE = mse
-    MSLE = msle
-    Hinge = hinge
-    
+    Sigmoid = SigmoidActivation()
+    Indentity = IndentityActivation()
+    Softmax = SoftmaxActivation()
+    Tanh = TanhActivation()
+    Relu = ReluActivation()
+    Cross_entropy = Loss('cross_entropy', cross_entropy, cross_entropy_gradient)
+    MSE = Loss('mse', mse, mse_gradient)
+    MSLE = Loss('msle', msle, msle_gradient)
+    Hinge = Loss('hinge', hinge, hinge_gradient)
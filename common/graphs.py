@@ -5,6 +5,7 @@ from matplotlib import pyplot
 from common.problem_type import problem_type
 from numpy import hstack
 
+from common.dataset import split_dataset
 from common.reader import prepare_data
 
 first_colors = ['darkred', 'darkgreen', 'darkblue']
@@ -12,8 +13,7 @@ second_colors = ['lightcoral', 'lime', 'royalblue']
 
 
 def generate_classification_graph_of_points(dataset, training):
-    X = np.array([data[0] for data in training])
-    y = np.array([data[1] for data in training])
+    X, y = split_dataset(training)
 
     unique = np.unique(y)
     for class_value in range(len(unique)):
@@ -21,8 +21,7 @@ def generate_classification_graph_of_points(dataset, training):
         pyplot.scatter(X[row_ix, 0], X[row_ix, 1],
                        color=first_colors[class_value], label = str(class_value + 1))
 
-    X = np.array([data[0] for data in dataset])
-    y = np.array([data[1] for data in dataset])
+    X, y = split_dataset(dataset)
 
     unique = np.unique(y)
     for class_value in range(len(unique)):
@@ -38,8 +37,7 @@ def generate_classification_graph_of_points(dataset, training):
 
 
 def generate_classification_graph_for_modelv2(model12, dataset, test_dataset):
-    X = np.array([data[0] for data in dataset])
-    y = np.array([data[1] for data in dataset])
+    X, y = split_dataset(dataset)
     min1, max1 = X[:, 0].min(), X[:, 0].max()
     min2, max2 = X[:, 1].min(), X[:, 1].max()
 
@@ -71,10 +69,39 @@ def generate_classification_graph_for_modelv2(model12, dataset, test_dataset):
     pyplot.legend()
     pyplot.show()
 
-def generate_classification_graph_for_model(model12, dataset, test_dataset, file_path=None):
-    pyplot.clf()
-    X = np.array([data[0] for data in dataset])
-    y = np.array([data[1] for data in dataset])
+def decision_surface(model12, xx, yy, coarse_factor=8, chunk_size=65536):
+    """
+    Classifies every point of the meshgrid (xx, yy). The grid is first evaluated
+    every coarse_factor points, then only the blocks lying on a class boundary
+    are evaluated at full resolution.
+    """
+    rows, cols = xx.shape
+    coarse_rows = np.minimum(np.arange(0, rows, coarse_factor) + coarse_factor // 2, rows - 1)
+    coarse_cols = np.minimum(np.arange(0, cols, coarse_factor) + coarse_factor // 2, cols - 1)
+    coarse_x = xx[np.ix_(coarse_rows, coarse_cols)]
+    coarse_y = yy[np.ix_(coarse_rows, coarse_cols)]
+    coarse = model12.predict_batch(np.column_stack((coarse_x.ravel(), coarse_y.ravel())),
+                                   chunk_size=chunk_size).reshape(coarse_x.shape)
+
+    padded = np.pad(coarse, 1, mode='edge')
+    boundary = np.zeros(coarse.shape, dtype=bool)
+    for d1 in (-1, 0, 1):
+        for d2 in (-1, 0, 1):
+            neighbours = padded[1 + d1:padded.shape[0] - 1 + d1, 1 + d2:padded.shape[1] - 1 + d2]
+            boundary |= neighbours != coarse
+
+    zz = np.repeat(np.repeat(coarse, coarse_factor, 0), coarse_factor, 1)[:rows, :cols]
+    refine = np.repeat(np.repeat(boundary, coarse_factor, 0), coarse_factor, 1)[:rows, :cols]
+    if refine.any():
+        points = np.column_stack((xx[refine], yy[refine]))
+        zz[refine] = model12.predict_batch(points, chunk_size=chunk_size)
+    return zz
+
+def classification_surface(model12, dataset, step=0.01, coarse_factor=8):
+    """
+    Returns the grid axes (x1grid, x2grid) around the dataset and the classes zz predicted on the grid.
+    """
+    X, y = split_dataset(dataset)
     min1, max1 = X[:, 0].min(), X[:, 0].max()
     min2, max2 = X[:, 1].min(), X[:, 1].max()
 
@@ -84,15 +111,17 @@ def generate_classification_graph_for_model(model12, dataset, test_dataset, file
     min1, max1 = min1 - dim1_coeff, max1 + dim1_coeff
     min2, max2 = min2 - dim2_coeff, max2 + dim2_coeff
 
-    x1grid = np.arange(min1, max1, 0.01)
-    x2grid = np.arange(min2, max2, 0.01)
+    x1grid = np.arange(min1, max1, step)
+    x2grid = np.arange(min2, max2, step)
     xx, yy = np.meshgrid(x1grid, x2grid)
-    r1, r2 = xx.flatten(), yy.flatten()
-    r1, r2 = r1.reshape((len(r1), 1)), r2.reshape((len(r2), 1))
-    grid = hstack((r1,r2))
+    zz = decision_surface(model12, xx, yy, coarse_factor)
+    return x1grid, x2grid, zz
 
-    pre = np.array(model12.predict_list(grid))
-    zz = pre.reshape(xx.shape)
+
+def draw_classification_surface(x1grid, x2grid, zz, dataset, file_path=None):
+    pyplot.clf()
+    X, y = split_dataset(dataset)
+    xx, yy = np.meshgrid(x1grid, x2grid)
 
     len_unique = len(np.unique(y))
     pyplot.contourf(xx, yy, zz, levels=len_unique-1, colors = second_colors)
@@ -110,6 +139,11 @@ def generate_classification_graph_for_model(model12, dataset, test_dataset, file
     else:
         pyplot.savefig(file_path)
 
+
+def generate_classification_graph_for_model(model12, dataset, test_dataset, file_path=None, step=0.01, coarse_factor=8):
+    x1grid, x2grid, zz = classification_surface(model12, dataset, step, coarse_factor)
+    draw_classification_surface(x1grid, x2grid, zz, dataset, file_path)
+
 def generate_regression_graph(targets, predictions, train, file_path=None):
     pyplot.clf()
     pyplot.scatter(targets[0], targets[1], c="black", label="targets", s=50)
@@ -142,16 +176,8 @@ def generate_loss_function_graph(epochs, train_loss, test_loss, loss_function =
         pyplot.savefig(file_path)
 
 def draw_regression(train_dataset, test_dataset, predictions, file_path = None):
-    x = []
-    y = []
-    for i in range(len(test_dataset)):
-        x.append(test_dataset[i][0])
-        y.append(test_dataset[i][1])
-    tx = []
-    ty = []
-    for i in range(len(train_dataset)):
-        tx.append(train_dataset[i][0])
-        ty.append(train_dataset[i][1])
+    x, y = split_dataset(test_dataset)
+    tx, ty = split_dataset(train_dataset)
     generate_regression_graph((x, y), (x, predictions), (tx, ty), file_path)
 
 
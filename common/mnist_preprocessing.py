@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import numpy as np
+from common.mnist_reader import MNIST_DIR
+
+PREPROCESSED_DIR = os.path.join(MNIST_DIR, 'preprocessed')
+
+
+def invert(images):
+    return 255 - images
+
+
+def threshold(images, value):
+    """
+    Pixels above value become 255, the others 0.
+    """
+    return np.where(images > value, np.uint8(255), np.uint8(0))
+
+
+def preprocess(images, invert_images=False, threshold_value=None, scale=False, dtype=np.float32):
+    """
+    Applies the deterministic transforms to a whole (N, ...) uint8 array at once.
+
+    Args:
+        threshold_value (int): binarize the images at this value, None to keep the gray levels
+        scale (bool): return dtype images in [0, 1] instead of uint8 ones
+    """
+    images = np.asarray(images)
+    if invert_images:
+        images = invert(images)
+    if threshold_value is not None:
+        images = threshold(images, threshold_value)
+    if scale:
+        images = images.astype(dtype) / dtype(255)
+    return images
+
+
+def cached_preprocess(images, directory=PREPROCESSED_DIR, **settings):
+    """
+    preprocess with the result kept as a .npy file, named by a hash of the settings and of the images,
+    and memory mapped on later calls. The keyword arguments are those of preprocess.
+    """
+    if not any(settings.get(name) for name in ('invert_images', 'scale')) and settings.get('threshold_value') is None:
+        return images
+    images = np.asarray(images)
+    digest = hashlib.sha1(json.dumps({key: str(value) for key, value in sorted(settings.items())}).encode())
+    digest.update(f'{images.dtype.str}{images.shape}'.encode())
+    digest.update(np.ascontiguousarray(images).data)
+    path = os.path.join(directory, digest.hexdigest() + '.npy')
+    if os.path.exists(path):
+        return np.load(path, mmap_mode='r')
+    result = preprocess(images, **settings)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, result)
+    os.replace(tmp_path, path)
+    return result
+
+
+def affine_transform(images, angles, shifts):
+    """
+    Rotates every image of the (N, H, W) array around its center by its angle (radians) and
+    shifts it by its (dy, dx), with bilinear interpolation and zero fill. All images at once.
+    """
+    n, height, width = images.shape
+    rows, cols = np.mgrid[0:height, 0:width].astype(np.float32)
+    center_row, center_col = (height - 1) / 2, (width - 1) / 2
+    cos = np.cos(angles).astype(np.float32)[:, None, None]
+    sin = np.sin(angles).astype(np.float32)[:, None, None]
+    # source coordinates of every output pixel: inverse shift, then inverse rotation
+    y = rows - center_row - shifts[:, 0, None, None]
+    x = cols - center_col - shifts[:, 1, None, None]
+    source_rows = cos * y - sin * x + center_row
+    source_cols = sin * y + cos * x + center_col
+
+    top = np.floor(source_rows)
+    left = np.floor(source_cols)
+    weight_row = source_rows - top
+    weight_col = source_cols - left
+    top = top.astype(np.intp)
+    left = left.astype(np.intp)
+    padded = np.zeros((n, height + 2, width + 2), np.float32)
+    padded[:, 1:-1, 1:-1] = images
+    index = np.arange(n)[:, None, None]
+    # neighbours outside of the image read the zero border, pixels further out are zeroed by inside
+    inside = (source_rows > -1) & (source_rows < height) & (source_cols > -1) & (source_cols < width)
+    top = np.clip(top + 1, 0, height)
+    left = np.clip(left + 1, 0, width)
+    result = (padded[index, top, left] * (1 - weight_row) * (1 - weight_col)
+              + padded[index, top, left + 1] * (1 - weight_row) * weight_col
+              + padded[index, top + 1, left] * weight_row * (1 - weight_col)
+              + padded[index, top + 1, left + 1] * weight_row * weight_col)
+    result *= inside
+    return result.astype(images.dtype) if np.issubdtype(images.dtype, np.floating) else \
+        np.clip(np.rint(result), 0, 255).astype(images.dtype)
+
+
+def augment(images, random, max_shift=2, max_rotation=10, side=28):
+    """
+    Random shifts of up to max_shift pixels and rotations of up to max_rotation degrees.
+
+    Args:
+        images (array): (N, side * side) or (N, side, side) images
+        random (RandomState): source of the random transforms
+    """
+    shape = images.shape
+    images = np.asarray(images).reshape(len(images), side, side)
+    angles = np.radians(random.uniform(-max_rotation, max_rotation, len(images)))
+    shifts = random.uniform(-max_shift, max_shift, (len(images), 2)).astype(np.float32)
+    return affine_transform(images, angles, shifts).reshape(shape)
+
+
+def augmented_chunks(X, y, random, chunk_size=4096, max_shift=2, max_rotation=10):
+    """
+    Yields (X, y) blocks with freshly augmented images, for a common.stream.DataStream
+    which runs it on its background thread.
+    """
+    for start in range(0, len(X), chunk_size):
+        yield augment(X[start:start + chunk_size], random, max_shift, max_rotation), y[start:start + chunk_size]
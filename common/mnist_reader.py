@@ -0,0 +1,79 @@
+import gzip
+import os
+import urllib.request
+import numpy as np
+
+MNIST_DIR = 'data/mnist'
+MNIST_URL = 'https://storage.googleapis.com/tensorflow/tf-keras-datasets/mnist.npz'
+CACHE_FILES = ('train_X.npy', 'train_y.npy', 'test_X.npy', 'test_y.npy')
+IDX_FILES = ('train-images-idx3-ubyte', 'train-labels-idx1-ubyte',
+             't10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte')
+
+
+def read_idx(path):
+    """
+    Reads a file in the IDX format used by the original MNIST distribution (optionally gzipped).
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        data = f.read()
+    dims = data[3]
+    shape = tuple(int.from_bytes(data[4 + 4 * i:8 + 4 * i], 'big') for i in range(dims))
+    return np.frombuffer(data, dtype=np.uint8, offset=4 + 4 * dims).reshape(shape)
+
+
+def find_idx_file(directory, name):
+    for filename in (name, name + '.gz'):
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_sources(directory, download=False):
+    """
+    Returns (train_X, train_y, test_X, test_y) read from mnist.npz or the four IDX files in the directory.
+    """
+    npz_path = os.path.join(directory, 'mnist.npz')
+    idx_paths = [find_idx_file(directory, name) for name in IDX_FILES]
+    if all(idx_paths):
+        return tuple(read_idx(path) for path in idx_paths)
+    if not os.path.exists(npz_path):
+        if not download:
+            raise FileNotFoundError(
+                f'Could not find MNIST in {directory} (expected mnist.npz or the IDX files)')
+        os.makedirs(directory, exist_ok=True)
+        urllib.request.urlretrieve(MNIST_URL, npz_path)
+    with np.load(npz_path) as f:
+        return f['x_train'], f['y_train'], f['x_test'], f['y_test']
+
+
+def convert_mnist(directory=MNIST_DIR, download=False):
+    """
+    Converts MNIST into .npy files which can be memory mapped on later runs.
+    """
+    for array, filename in zip(read_sources(directory, download), CACHE_FILES):
+        tmp_path = os.path.join(directory, 'tmp_' + filename)
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, os.path.join(directory, filename))
+
+
+def load_mnist(directory=MNIST_DIR, flatten=True, mmap_mode='r', download=False):
+    """
+    Args:
+        directory (str): directory with the cache and the source files
+        flatten (bool): return images as (N, 784) views instead of (N, 28, 28)
+        mmap_mode (str): mode passed to np.load, 'c' gives writable copy-on-write arrays
+        download (bool): download mnist.npz if neither the cache nor the sources exist
+
+    Returns:
+        (train_X, train_y), (test_X, test_y)
+    """
+    paths = [os.path.join(directory, filename) for filename in CACHE_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        convert_mnist(directory, download)
+    train_X, train_y, test_X, test_y = [np.load(path, mmap_mode=mmap_mode) for path in paths]
+    if flatten:
+        train_X = train_X.reshape(len(train_X), -1)
+        test_X = test_X.reshape(len(test_X), -1)
+    return (train_X, train_y), (test_X, test_y)
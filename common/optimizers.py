@@ -0,0 +1,208 @@
+import numpy as np
+
+
+class Schedule:
+    """
+    Constant learning rate. Schedules return the factor the model's learning_rate is multiplied by
+    at a given optimizer step (one step per batch).
+    """
+
+    hyperparameters = ()
+
+    def __call__(self, step):
+        return 1.0
+
+    def config(self):
+        config = {'name': type(self).__name__}
+        for name in self.hyperparameters:
+            value = getattr(self, name)
+            config[name] = value.config() if isinstance(value, Schedule) else value
+        return config
+
+
+class StepSchedule(Schedule):
+    """
+    Multiplies the learning rate by gamma every step_size steps.
+    """
+
+    hyperparameters = ('step_size', 'gamma')
+
+    def __init__(self, step_size, gamma=0.1):
+        self.step_size = step_size
+        self.gamma = gamma
+
+    def __call__(self, step):
+        return self.gamma ** (step // self.step_size)
+
+
+class CosineSchedule(Schedule):
+    """
+    Cosine decay from the full learning rate to min_factor of it over total_steps steps.
+    """
+
+    hyperparameters = ('total_steps', 'min_factor')
+
+    def __init__(self, total_steps, min_factor=0.0):
+        self.total_steps = total_steps
+        self.min_factor = min_factor
+
+    def __call__(self, step):
+        progress = min(step / self.total_steps, 1.0)
+        return self.min_factor + (1 - self.min_factor) * 0.5 * (1 + np.cos(np.pi * progress))
+
+
+class WarmupSchedule(Schedule):
+    """
+    Linear warmup over warmup_steps steps, followed by the given schedule (counted from the end of the warmup).
+    """
+
+    hyperparameters = ('warmup_steps', 'schedule')
+
+    def __init__(self, warmup_steps, schedule=None):
+        self.warmup_steps = warmup_steps
+        self.schedule = schedule or Schedule()
+
+    def __call__(self, step):
+        if step < self.warmup_steps:
+            return (step + 1) / self.warmup_steps
+        return self.schedule(step - self.warmup_steps)
+
+
+class Optimizer:
+    """
+    Updates the flat parameter buffer of an MLP from its gradient buffer. Set it as model.optimizer,
+    without one the model does plain SGD. The state arrays (self.state) are saved in checkpoints.
+    """
+
+    hyperparameters = ('weight_decay',)
+
+    def __init__(self, schedule=None, weight_decay=0.0):
+        """
+        Args:
+            schedule (Schedule): learning rate schedule, constant if None
+            weight_decay (float): L2 penalty added to the gradients
+        """
+        self.schedule = schedule or Schedule()
+        self.weight_decay = weight_decay
+        self.steps = 0
+        self.state = {}
+
+    def slot(self, name, parameters):
+        if name not in self.state:
+            self.state[name] = np.zeros(parameters.shape, parameters.dtype)
+        return self.state[name]
+
+    def step(self, parameters, gradients, learning_rate):
+        """
+        Updates parameters in place, gradients is used as scratch space.
+        """
+        rate = learning_rate * self.schedule(self.steps)
+        if self.weight_decay:
+            gradients += self.weight_decay * parameters
+        self.update(parameters, gradients, rate)
+        self.steps += 1
+
+    def update(self, parameters, gradients, rate):
+        raise NotImplementedError
+
+    def config(self):
+        config = {'name': type(self).__name__, 'schedule': self.schedule.config()}
+        for name in self.hyperparameters:
+            config[name] = getattr(self, name)
+        return config
+
+
+class SGD(Optimizer):
+    hyperparameters = ('momentum', 'nesterov', 'weight_decay')
+
+    def __init__(self, momentum=0.0, nesterov=False, schedule=None, weight_decay=0.0):
+        super().__init__(schedule, weight_decay)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def update(self, parameters, gradients, rate):
+        if self.momentum:
+            velocity = self.slot('velocity', parameters)
+            velocity *= self.momentum
+            velocity += gradients
+            if self.nesterov:
+                gradients += self.momentum * velocity
+            else:
+                gradients[:] = velocity
+        gradients *= rate
+        parameters -= gradients
+
+
+class RMSProp(Optimizer):
+    hyperparameters = ('rho', 'epsilon', 'weight_decay')
+
+    def __init__(self, rho=0.9, epsilon=1e-8, schedule=None, weight_decay=0.0):
+        super().__init__(schedule, weight_decay)
+        self.rho = rho
+        self.epsilon = epsilon
+
+    def update(self, parameters, gradients, rate):
+        square = self.slot('square', parameters)
+        square *= self.rho
+        square += (1 - self.rho) * np.square(gradients)
+        gradients *= rate
+        gradients /= np.sqrt(square) + self.epsilon
+        parameters -= gradients
+
+
+class Adam(Optimizer):
+    hyperparameters = ('beta1', 'beta2', 'epsilon', 'weight_decay')
+
+    def __init__(self, beta1=0.9, beta2=0.999, epsilon=1e-8, schedule=None, weight_decay=0.0):
+        super().__init__(schedule, weight_decay)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def update(self, parameters, gradients, rate):
+        mean = self.slot('mean', parameters)
+        square = self.slot('square', parameters)
+        mean *= self.beta1
+        mean += (1 - self.beta1) * gradients
+        square *= self.beta2
+        square += (1 - self.beta2) * np.square(gradients)
+        t = self.steps + 1
+        rate = rate * np.sqrt(1 - self.beta2 ** t) / (1 - self.beta1 ** t)
+        np.sqrt(square, out=gradients)
+        gradients += self.epsilon
+        np.divide(mean, gradients, out=gradients)
+        gradients *= rate
+        parameters -= gradients
+
+
+OPTIMIZERS = {cls.__name__: cls for cls in (SGD, RMSProp, Adam)}
+SCHEDULES = {cls.__name__: cls for cls in (Schedule, StepSchedule, CosineSchedule, WarmupSchedule)}
+
+
+def schedule_from_config(config):
+    config = dict(config)
+    cls = SCHEDULES[config.pop('name')]
+    if 'schedule' in config:
+        config['schedule'] = schedule_from_config(config['schedule'])
+    return cls(**config)
+
+
+def optimizer_from_config(config):
+    config = dict(config)
+    cls = OPTIMIZERS[config.pop('name')]
+    config['schedule'] = schedule_from_config(config['schedule'])
+    return cls(**config)
+
+
+def optimizer_state(optimizer):
+    """
+    Returns (JSON serializable description, state arrays) of an optimizer, see restore_optimizer.
+    """
+    return {'config': optimizer.config(), 'steps': optimizer.steps}, dict(optimizer.state)
+
+
+def restore_optimizer(description, arrays):
+    optimizer = optimizer_from_config(description['config'])
+    optimizer.steps = description['steps']
+    optimizer.state = {name: np.array(array) for name, array in arrays.items()}
+    return optimizer
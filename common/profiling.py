@@ -0,0 +1,170 @@
+import sys
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of this process in MB, None where the platform does not report it.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Callback:
+    """
+    Base class of training hooks. MLP calls these methods of every object in model.callbacks.
+    """
+
+    def on_step(self, model, step, batch_size):
+        """
+        After the parameter update of batch number step (counted from 0 in every call to train).
+        """
+        pass
+
+    def on_epoch_end(self, model, epoch):
+        """
+        After every epoch, epoch is the number of epochs trained so far (model.epoch).
+        """
+        pass
+
+    def on_evaluation(self, model, metrics):
+        """
+        After every evaluation, metrics is a dict of the computed scores.
+        """
+        pass
+
+
+class TargetAccuracy(Callback):
+    """
+    Reports the wall time and epoch at which the evaluated accuracy first reaches the target.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.epoch = None
+
+    def on_evaluation(self, model, metrics):
+        if self.seconds is None and metrics.get('accuracy', 0) >= self.target:
+            self.seconds = time.perf_counter() - self.start
+            self.epoch = model.epoch
+            print(f"Reached {self.target}% after {self.seconds:.1f} s (epoch {self.epoch})")
+
+
+class Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """
+    Accumulates wall time per phase of training (data, forward, backward, update, evaluation)
+    and the number of trained samples. Attach with model.profiler = Profiler().
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.timers = {}
+        self.samples = 0
+        self.created = time.perf_counter()
+
+    def phase(self, name):
+        if name not in self.timers:
+            self.timers[name] = Timer(self, name)
+        return self.timers[name]
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of the iterable, counting the time spent waiting for each of them as phase name.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(name, time.perf_counter() - start)
+            yield item
+
+    def add(self, name, seconds):
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, samples):
+        self.samples += samples
+
+    def merge(self, other, share=1.0):
+        """
+        Adds the phases and samples of another profiler, its times scaled by share.
+        """
+        for name, seconds in other.times.items():
+            self.times[name] += seconds * share
+            self.calls[name] += other.calls[name]
+        self.samples += other.samples
+
+    def summary(self):
+        training = sum(self.times[name] for name in ('data', 'forward', 'backward', 'update'))
+        return {
+            'phases': {name: {'seconds': self.times[name], 'calls': self.calls[name]} for name in self.times},
+            'samples': self.samples,
+            'samples_per_second': self.samples / training if training else None,
+            'wall_seconds': time.perf_counter() - self.created,
+            'peak_memory_mb': peak_memory_mb(),
+        }
+
+
+class NullProfiler:
+    """
+    Profiler used when none is attached, every method is a no-op.
+    """
+
+    class NullTimer:
+        def __enter__(self):
+            pass
+
+        def __exit__(self, *exc):
+            pass
+
+    timer = NullTimer()
+
+    def phase(self, name):
+        return self.timer
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, samples):
+        pass
+
+    def merge(self, other, share=1.0):
+        pass
+
+    def summary(self):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
@@ -1,22 +1,36 @@
+import json
+import os
 import numpy as np
 import pandas as pd
 from common.problem_type import problem_type
 
+CACHE_SUFFIX = '.cache.npy'
+METADATA_SUFFIX = '.cache.json'
+# the distinct targets are kept in the metadata only up to this number, i.e. for classification files
+MAX_CACHED_LABELS = 1024
+
 
 def normalize_data(dataset):
-    norm = np.linalg.norm(dataset)
-    return [[elem[0], elem[1]/norm] for elem in dataset]
+    X, y = dataset
+    return X, y / np.linalg.norm(y)
+
 
+def normalize(train_dataset, test_dataset, statistics=None):
+    """
+    Min-max normalization of the targets of both datasets.
 
-def normalize(train_dataset, test_dataset):
-    Y_train = [y for x, y in train_dataset]
-    Y_test = [y for x, y in test_dataset]
-    Y_all = np.concatenate((Y_train, Y_test))
-    mins = np.min(Y_all, 0)
-    maxs = np.max(Y_all, 0)
+    Args:
+        statistics (tuple): precomputed (min, max) of the targets, see target_statistics
+    """
+    X_train, Y_train = train_dataset
+    X_test, Y_test = test_dataset
+    if statistics is None:
+        Y_all = np.concatenate((Y_train, Y_test))
+        statistics = (np.min(Y_all, 0), np.max(Y_all, 0))
+    mins, maxs = statistics
     diff = maxs - mins
-    train_dataset = [(x, (y-mins)/diff) for x, y in train_dataset]
-    test_dataset = [(x, (y-mins)/diff) for x, y in test_dataset]
+    train_dataset = (X_train, ((Y_train - mins) / diff).astype(Y_train.dtype, copy=False))
+    test_dataset = (X_test, ((Y_test - mins) / diff).astype(Y_test.dtype, copy=False))
     return train_dataset, test_dataset
 
 
@@ -27,27 +41,105 @@ def read_file(filename: str, ):
         raise FileNotFoundError('Could not find the file')
 
 
-def prepare_data(p_type: problem_type, filename: str, with_filename=False):
+def source_signature(filename):
+    stat = os.stat(filename)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def read_metadata(filename):
+    try:
+        with open(filename + METADATA_SUFFIX) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('source') != source_signature(filename):
+        return None
+    return metadata
+
+
+def write_cache(filename, columns):
+    labels = np.unique(columns[-1])
+    metadata = {
+        'source': source_signature(filename),
+        'shape': list(columns.shape),
+        'mins': columns.min(axis=1).tolist(),
+        'maxs': columns.max(axis=1).tolist(),
+        'labels': labels.tolist() if len(labels) <= MAX_CACHED_LABELS else None,
+    }
+    tmp_suffix = f'.{os.getpid()}.tmp'
     try:
-        data = read_file(filename)
+        with open(filename + CACHE_SUFFIX + tmp_suffix, 'wb') as f:
+            np.save(f, columns)
+        os.replace(filename + CACHE_SUFFIX + tmp_suffix, filename + CACHE_SUFFIX)
+        with open(filename + METADATA_SUFFIX + tmp_suffix, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(filename + METADATA_SUFFIX + tmp_suffix, filename + METADATA_SUFFIX)
+    except OSError:
+        pass
+    return metadata
+
+
+def load_columns(filename: str):
+    """
+    Returns the CSV file as a (columns, rows) float64 array together with its cached metadata.
+    The array is memory mapped from a binary cache kept next to the file, which is rebuilt
+    when the file's mtime or size changes.
+    """
+    if not os.path.exists(filename):
+        raise FileNotFoundError('Could not find the file')
+    metadata = read_metadata(filename)
+    if metadata is not None:
+        try:
+            return np.load(filename + CACHE_SUFFIX, mmap_mode='r'), metadata
+        except (OSError, ValueError):
+            pass
+    columns = np.ascontiguousarray(pd.read_csv(filename).to_numpy(dtype=np.float64).T)
+    return columns, write_cache(filename, columns)
+
+
+def read_columns(filename: str):
+    return load_columns(filename)[0]
+
+
+def target_statistics(*filenames):
+    """
+    Returns (min, max) of the target column over all given files, using the statistics stored in the cache.
+    """
+    metadata = [load_columns(filename)[1] for filename in filenames]
+    return min(m['mins'][-1] for m in metadata), max(m['maxs'][-1] for m in metadata)
+
+
+def prepare_data(p_type: problem_type, filename: str, with_filename=False, dtype=np.float64):
+    """
+    Returns the dataset as a pair (X, y), X has one row per sample.
+    """
+    try:
+        columns = read_columns(filename)
         if p_type == problem_type.Regression:
-            dataset = []
-            for row in data:
-                dataset.append([np.array([row[0]]), row[1]])
-            if not with_filename:
-                return dataset
-            return (dataset, filename)
+            X = columns[:1].T.astype(dtype, copy=False)
+            y = columns[1].astype(dtype, copy=False)
         elif p_type == problem_type.Classification:
-            dataset = []
-            for row in data:
-                dataset.append([np.array([row[0], row[1]]), row[2]])
-            if not with_filename:
-                return dataset
-            return (dataset, filename)
+            X = columns[:2].T.astype(dtype, copy=False)
+            y = columns[2]
+        else:
+            raise ValueError("The problem type was wrong")
+        if not with_filename:
+            return (X, y)
+        return ((X, y), filename)
     except:
         raise
 
-    raise ValueError("The problem type was wrong")
+
+def load_dataset_pair(p_type: problem_type, train_filename: str, test_filename: str, dtype=np.float64):
+    """
+    Reads a train and a test dataset, regression targets are normalized with the statistics of both files.
+    """
+    train_dataset = prepare_data(p_type, train_filename, dtype=dtype)
+    test_dataset = prepare_data(p_type, test_filename, dtype=dtype)
+    if p_type == problem_type.Regression:
+        statistics = target_statistics(train_filename, test_filename)
+        train_dataset, test_dataset = normalize(train_dataset, test_dataset, statistics)
+    return train_dataset, test_dataset
 
 
 if __name__ == "__main__":
@@ -61,4 +153,4 @@ if __name__ == "__main__":
 
     print(result)
     print(normalize_data(result))
-    print(len(result))
+    print(len(result[0]))
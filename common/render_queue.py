@@ -0,0 +1,156 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import matplotlib
+import numpy as np
+
+PLOTS_DIR = 'data/results/plots'
+JOB_SUFFIX = '.npz'
+RENDERED_SUFFIX = '.rendered'
+
+
+def loss_plot(epochs, train_loss, test_loss, loss_function, file_path):
+    return {'kind': 'loss', 'file_path': file_path, 'loss_function': loss_function,
+            'epochs': np.asarray(epochs), 'train_loss': np.asarray(train_loss), 'test_loss': np.asarray(test_loss)}
+
+
+def regression_plot(train_dataset, test_dataset, predictions, file_path):
+    (train_X, train_y), (test_X, test_y) = train_dataset, test_dataset
+    return {'kind': 'regression', 'file_path': file_path, 'train_X': train_X, 'train_y': train_y,
+            'test_X': test_X, 'test_y': test_y, 'predictions': np.asarray(predictions)}
+
+
+def classification_plot(x1grid, x2grid, zz, dataset, file_path):
+    X, y = dataset
+    return {'kind': 'classification', 'file_path': file_path, 'x1grid': x1grid, 'x2grid': x2grid,
+            'zz': zz.astype(np.int8), 'X': X, 'y': y}
+
+
+def write_job(job, directory=PLOTS_DIR):
+    """
+    Stores the data of one plot as directory/<image name>.npz and returns its path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, os.path.basename(job['file_path']) + JOB_SUFFIX)
+    arrays = {key: value for key, value in job.items() if isinstance(value, np.ndarray)}
+    meta = {key: value for key, value in job.items() if key not in arrays}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_job(path):
+    with np.load(path) as f:
+        job = json.loads(str(f['meta']))
+        job.update({key: f[key] for key in f.files if key != 'meta'})
+    return job
+
+
+def job_digest(job):
+    """
+    Hash of everything the image depends on. The .npz bytes themselves are not stable (zip timestamps).
+    """
+    digest = hashlib.sha1()
+    for key in sorted(job):
+        value = job[key]
+        digest.update(key.encode())
+        if isinstance(value, np.ndarray):
+            digest.update(f'{value.dtype.str}{value.shape}'.encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(json.dumps(value).encode())
+    return digest.hexdigest()
+
+
+def render_job(job):
+    from common.graphs import draw_classification_surface, draw_regression, generate_loss_function_graph
+    if job['kind'] == 'loss':
+        generate_loss_function_graph(job['epochs'], job['train_loss'], job['test_loss'], job['loss_function'],
+                                     job['file_path'])
+    elif job['kind'] == 'regression':
+        draw_regression((job['train_X'], job['train_y']), (job['test_X'], job['test_y']), job['predictions'],
+                        job['file_path'])
+    elif job['kind'] == 'classification':
+        draw_classification_surface(job['x1grid'], job['x2grid'], job['zz'], (job['X'], job['y']), job['file_path'])
+    else:
+        raise ValueError(f'Unknown plot kind {job["kind"]}')
+
+
+def render_job_file(path):
+    """
+    Renders a stored plot unless its image exists and was drawn from the same data.
+    Returns True if the image was drawn.
+    """
+    job = read_job(path)
+    digest = job_digest(job)
+    try:
+        with open(path + RENDERED_SUFFIX) as f:
+            if f.read() == digest and os.path.exists(job['file_path']):
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(job['file_path']) or '.', exist_ok=True)
+    render_job(job)
+    with open(path + RENDERED_SUFFIX, 'w') as f:
+        f.write(digest)
+    return True
+
+
+def use_agg():
+    matplotlib.use('Agg', force=True)
+
+
+def render_all(directory=PLOTS_DIR, processes=1):
+    """
+    Renders every stored plot of the directory, returns the number of images drawn.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*' + JOB_SUFFIX)))
+    if processes == 1:
+        use_agg()
+        return sum(render_job_file(path) for path in paths)
+    with multiprocessing.Pool(processes, initializer=use_agg) as p:
+        return sum(p.imap_unordered(render_job_file, paths, chunksize=8))
+
+
+def render_worker(queue):
+    use_agg()
+    while True:
+        paths = queue.get()
+        if paths is None:
+            break
+        for path in paths:
+            try:
+                render_job_file(path)
+            except Exception as e:
+                print(f'Could not render {path}: {e}')
+
+
+class Renderer:
+    """
+    Dedicated headless process drawing the plots submitted by the sweep while the pool keeps training.
+    """
+
+    def __init__(self):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=render_worker, args=(self.queue,), daemon=True)
+        self.process.start()
+
+    def submit(self, paths):
+        self.queue.put(list(paths))
+
+    def close(self):
+        self.queue.put(None)
+        self.process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Draws the plots stored by the test sweep')
+    parser.add_argument('directory', nargs='?', default=PLOTS_DIR)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+    print(f'Rendered {render_all(args.directory, args.processes)} plots')
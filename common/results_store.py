@@ -0,0 +1,126 @@
+import json
+import sqlite3
+import time
+
+RESULTS_DB = 'data/results/results.sqlite'
+# configuration values stored as their own indexed columns, the whole configuration is kept as JSON
+CONFIG_COLUMNS = ['name', 'problem_type', 'layers', 'bias', 'activation_function', 'output_function', 'loss_functions',
+                  'optimizer', 'learning_rate', 'epochs', 'batch_size', 'dtype', 'seed', 'train_dataset', 'test_dataset']
+INDEXED_COLUMNS = ['name', 'problem_type', 'layers', 'activation_function', 'train_dataset']
+METRIC_COLUMNS = ['loss1', 'loss2', 'train_loss1', 'train_loss2', 'accuracy']
+
+
+def column_value(value):
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+class ResultsStore:
+    """
+    SQLite file holding one row per run (configuration) and one row per evaluated epoch.
+    Writes are buffered and committed in batches, one transaction per flush.
+    """
+
+    def __init__(self, path=RESULTS_DB, buffer_size=100):
+        """
+        Args:
+            buffer_size (int): number of buffered runs and metric rows which triggers a flush
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.pending_runs = []
+        self.pending_metrics = []
+        # concurrent writers wait for the lock instead of failing
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+
+    def create_tables(self):
+        columns = ', '.join(CONFIG_COLUMNS)
+        metrics = ', '.join(f'{name} REAL' for name in METRIC_COLUMNS)
+        with self.connection:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL, {columns}, '
+                'config TEXT, profile TEXT, updated REAL)')
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS metrics (run_id INTEGER NOT NULL REFERENCES runs(id), '
+                f'epoch INTEGER NOT NULL, {metrics}, PRIMARY KEY (run_id, epoch)) WITHOUT ROWID')
+            for column in INDEXED_COLUMNS:
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS runs_{column} ON runs ({column})')
+
+    def add_run(self, config_hash, config, metrics=None, profile=None):
+        """
+        Inserts or updates a run.
+
+        Args:
+            config (dict): configuration, keys of CONFIG_COLUMNS get their own columns
+            metrics (list): dicts with 'epoch' and keys of METRIC_COLUMNS, replacing the stored ones if given
+            profile (dict): summary of common.profiling.Profiler
+        """
+        self.pending_runs.append((config_hash, config, profile))
+        if metrics is not None:
+            self.pending_metrics.append((config_hash, True, metrics))
+        self.flush_if_full()
+
+    def add_metrics(self, config_hash, metrics):
+        """
+        Adds metric rows (see add_run) to a run, rows of already stored epochs are replaced.
+        """
+        self.pending_metrics.append((config_hash, False, metrics))
+        self.flush_if_full()
+
+    def flush_if_full(self):
+        if len(self.pending_runs) + len(self.pending_metrics) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_runs and not self.pending_metrics:
+            return
+        columns = ['hash'] + CONFIG_COLUMNS + ['config', 'profile', 'updated']
+        updates = ', '.join(f'{column}=excluded.{column}' for column in columns[1:] if column != 'profile')
+        insert_run = (f'INSERT INTO runs ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                      f'ON CONFLICT(hash) DO UPDATE SET {updates}, profile=COALESCE(excluded.profile, profile)')
+        insert_metrics = (f'INSERT OR REPLACE INTO metrics (run_id, epoch, {", ".join(METRIC_COLUMNS)}) '
+                          f'VALUES ((SELECT id FROM runs WHERE hash=?), ?{", ?" * len(METRIC_COLUMNS)})')
+        now = time.time()
+        # a batch which fails (e.g. metrics of an unknown run) is rolled back and not retried
+        runs, self.pending_runs = self.pending_runs, []
+        metrics_batches, self.pending_metrics = self.pending_metrics, []
+        with self.connection:
+            self.connection.executemany(insert_run, [
+                [config_hash] + [column_value(config.get(column)) for column in CONFIG_COLUMNS]
+                + [json.dumps(config, sort_keys=True), json.dumps(profile) if profile is not None else None, now]
+                for config_hash, config, profile in runs])
+            for config_hash, replace, metrics in metrics_batches:
+                if replace:
+                    self.connection.execute('DELETE FROM metrics WHERE run_id=(SELECT id FROM runs WHERE hash=?)',
+                                            (config_hash,))
+                self.connection.executemany(insert_metrics, [
+                    [config_hash, row['epoch']] + [row.get(column) for column in METRIC_COLUMNS] for row in metrics])
+
+    def query(self, sql, parameters=()):
+        """
+        Runs a query after flushing the buffer and returns the rows as dicts.
+        """
+        self.flush()
+        cursor = self.connection.execute(sql, parameters)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def runs(self, **filters):
+        """
+        Returns the runs whose columns equal the given values, e.g. runs(problem_type='classification').
+        """
+        where = ' AND '.join(f'{column}=?' for column in filters) or '1'
+        return self.query(f'SELECT * FROM runs WHERE {where} ORDER BY name',
+                          [column_value(value) for value in filters.values()])
+
+    def metrics(self, config_hash):
+        return self.query('SELECT metrics.* FROM metrics JOIN runs ON runs.id=metrics.run_id '
+                          'WHERE runs.hash=? ORDER BY epoch', (config_hash,))
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+
+
+def estimate_cost(test, train_size, test_size):
+    """
+    Rough number of multiply-adds of a test: training passes (forward and backward)
+    plus the evaluation of both datasets after every repetition.
+    """
+    layers = test.mpl.layers
+    forward = sum(layers[i] * layers[i + 1] for i in range(len(layers) - 1))
+    training = 3 * forward * train_size * test.mpl.epochs
+    evaluation = forward * (train_size + test_size)
+    return test.n_repetition * (training + evaluation)
+
+
+def in_shard(config_hash, shard, shards):
+    return int(config_hash, 16) % shards == shard
+
+
+class CompletedRuns:
+    """
+    Append-only file with the config hashes of finished tests, one per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.hashes = {line.split(';')[0] for line in f if line.strip()}
+
+    def __contains__(self, config_hash):
+        return config_hash in self.hashes
+
+    def add(self, config_hash, name):
+        self.hashes.add(config_hash)
+        with open(self.path, 'a') as f:
+            f.write(f'{config_hash};{name}\n')
+
+
+def schedule(tests, costs, completed=None, shard=0, shards=1):
+    """
+    Returns the tests of the shard which are not completed yet, the most expensive first.
+
+    Args:
+        costs (list): estimated cost of every test, see estimate_cost
+        completed (CompletedRuns): tests to skip
+    """
+    selected = []
+    for test, cost in zip(tests, costs):
+        config_hash = test.config_hash()
+        if not in_shard(config_hash, shard, shards):
+            continue
+        if completed is not None and config_hash in completed:
+            continue
+        selected.append((cost, test))
+    order = np.argsort([-cost for cost, _ in selected], kind='stable')
+    return [selected[i][1] for i in order]
+
+
+def schedule_groups(groups, completed=None, shard=0, shards=1):
+    """
+    Like schedule for groups of tests which run together. A group is assigned to a shard as a whole
+    and keeps its tests which are not completed yet; the most expensive groups come first.
+
+    Args:
+        groups (list): (group_hash, tests, costs) of every group, group_hash being a hex digest
+            which is the same on every machine
+        completed (CompletedRuns): tests to skip
+    """
+    selected = []
+    for group_hash, tests, costs in groups:
+        if not in_shard(group_hash, shard, shards):
+            continue
+        remaining = [(test, cost) for test, cost in zip(tests, costs)
+                     if completed is None or test.config_hash() not in completed]
+        if remaining:
+            selected.append((sum(cost for _, cost in remaining), [test for test, _ in remaining]))
+    order = np.argsort([-cost for cost, _ in selected], kind='stable')
+    return [selected[i][1] for i in order]
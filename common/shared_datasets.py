@@ -0,0 +1,97 @@
+from multiprocessing import shared_memory
+import numpy as np
+from common.reader import load_dataset_pair
+
+# datasets attached by attach_datasets in a pool worker, key -> (train_dataset, test_dataset)
+attached_datasets = {}
+attached_memory = []
+
+
+def dataset_key(train_path, test_path, dtype):
+    return (train_path, test_path, np.dtype(dtype).str)
+
+
+class DatasetRegistry:
+    """
+    Loads every (train, test) pair once in the parent process and publishes it in shared memory,
+    so pool workers can attach to it without copying or parsing the files again.
+    """
+
+    def __init__(self):
+        self.datasets = {}
+        self.memory = []
+
+    def load(self, p_type, train_path, test_path, dtype=np.float64):
+        key = dataset_key(train_path, test_path, dtype)
+        if key not in self.datasets:
+            self.datasets[key] = load_dataset_pair(p_type, train_path, test_path, dtype)
+        return self.datasets[key]
+
+    def share(self):
+        """
+        Copies all loaded datasets into shared memory and returns their descriptors for attach_datasets.
+        """
+        descriptors = {}
+        for key, (train_dataset, test_dataset) in self.datasets.items():
+            descriptors[key] = [share_array(array, self.memory)[1] for array in (*train_dataset, *test_dataset)]
+        return descriptors
+
+    def close(self):
+        release(self.memory, unlink=True)
+
+
+def share_array(array, memories):
+    """
+    Copies the array into a new shared memory block, which is appended to memories.
+
+    Returns:
+        (shared array, descriptor for attach_array)
+    """
+    array = np.ascontiguousarray(array)
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    memories.append(memory)
+    shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+    shared[...] = array
+    return shared, (memory.name, array.shape, array.dtype.str)
+
+
+def attach_array(descriptor, memories, writeable=False):
+    """
+    Maps an array published by share_array in another process, its block is appended to memories.
+    """
+    name, shape, dtype = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    memories.append(memory)
+    array = np.ndarray(shape, dtype, buffer=memory.buf)
+    array.flags.writeable = writeable
+    return array
+
+
+def release(memories, unlink=False):
+    """
+    Closes the shared memory blocks, unlink frees them once the process which created them is done.
+    """
+    for memory in memories:
+        memory.close()
+        if unlink:
+            memory.unlink()
+    memories.clear()
+
+
+def attach_datasets(descriptors):
+    """
+    Pool initializer: maps the datasets published by DatasetRegistry.share into this process.
+    """
+    for key, arrays in descriptors.items():
+        X_train, y_train, X_test, y_test = [attach_array(descriptor, attached_memory) for descriptor in arrays]
+        attached_datasets[key] = ((X_train, y_train), (X_test, y_test))
+
+
+def get_dataset_pair(p_type, train_path, test_path, dtype=np.float64):
+    """
+    Returns the shared (train_dataset, test_dataset) if this process attached it, otherwise reads the files.
+    """
+    key = dataset_key(train_path, test_path, dtype)
+    if key in attached_datasets:
+        return attached_datasets[key]
+    return load_dataset_pair(p_type, train_path, test_path, dtype)
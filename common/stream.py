@@ -0,0 +1,204 @@
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from common.reader import read_metadata
+
+
+def csv_chunks(filename: str, chunk_size=65536):
+    """
+    Yields the CSV file as (X, y) blocks of at most chunk_size rows, the last column is the target.
+    """
+    for chunk in pd.read_csv(filename, chunksize=chunk_size):
+        rows = chunk.to_numpy(dtype=np.float64)
+        yield rows[:, :-1], rows[:, -1]
+
+
+def array_chunks(X, y, chunk_size=65536):
+    """
+    Yields (X, y) blocks of at most chunk_size rows. With memory mapped arrays only the current block is read.
+    """
+    for start in range(0, len(X), chunk_size):
+        yield X[start:start + chunk_size], y[start:start + chunk_size]
+
+
+def npy_chunks(filename: str, chunk_size=65536, columnar=False):
+    """
+    Yields (X, y) blocks of a .npy file holding one sample per row, the last column is the target.
+
+    Args:
+        columnar (bool): the file holds one column per row instead, like the CSV caches of common.reader
+    """
+    array = np.load(filename, mmap_mode='r')
+    if columnar:
+        for start in range(0, array.shape[1], chunk_size):
+            block = array[:, start:start + chunk_size]
+            yield block[:-1].T, block[-1]
+    else:
+        yield from array_chunks(array[:, :-1], array[:, -1], chunk_size)
+
+
+def stream_statistics(*sources):
+    """
+    One pass over the given chunk iterators.
+
+    Returns:
+        (min, max) of the targets and the sorted unique targets
+    """
+    minimum, maximum = np.inf, -np.inf
+    labels = np.array([])
+    for chunks in sources:
+        for _, y in chunks:
+            minimum = min(minimum, float(np.min(y)))
+            maximum = max(maximum, float(np.max(y)))
+            labels = np.union1d(labels, np.unique(y))
+    return (minimum, maximum), labels
+
+
+def cached_statistics(filenames, classification):
+    """
+    The result of stream_statistics taken from the up-to-date caches of common.reader, without reading
+    the files. None if a file has no such cache, or, for classification, no cached labels.
+    """
+    metadata = [read_metadata(filename) for filename in filenames]
+    if any(m is None or (classification and m.get('labels') is None) for m in metadata):
+        return None
+    statistics = (min(m['mins'][-1] for m in metadata), max(m['maxs'][-1] for m in metadata))
+    labels = np.unique(np.concatenate([m['labels'] for m in metadata])) if classification else None
+    return statistics, labels
+
+
+def put_until_stopped(items, item, stop):
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def prefetch(iterable, depth=2):
+    """
+    Runs the iterable on a background thread which keeps up to depth items ready.
+    Exceptions raised while producing are re-raised in the consuming thread.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put_until_stopped(items, (item, None), stop):
+                    return
+            put_until_stopped(items, (done, None), stop)
+        except BaseException as e:
+            put_until_stopped(items, (done, e), stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class DataStream:
+    """
+    Training data read chunk by chunk, so only the shuffle buffer has to fit in memory.
+    Every call to batches() is one pass over the source; reading, normalizing, shuffling and
+    encoding of the next batches happen on a background thread while the current one is trained on.
+    """
+
+    def __init__(self, chunks, classes=None, statistics=None, buffer_size=65536, prefetch_batches=2, seed=None):
+        """
+        Args:
+            chunks (callable): returns a new iterator of (X, y) blocks, e.g. lambda: csv_chunks(path)
+            classes (int): number of classes of a classification dataset, None for regression
+            statistics (tuple): (min, max) used to min-max normalize the targets, as in reader.normalize
+            buffer_size (int): number of samples shuffled together, 0 keeps the order of the source
+            prefetch_batches (int): number of batches prepared ahead
+            seed (int): seed of the shuffle buffer, drawn from np.random by default
+        """
+        self.chunks = chunks
+        self.classes = classes
+        self.statistics = statistics
+        self.buffer_size = buffer_size
+        self.prefetch_batches = prefetch_batches
+        self.random = np.random.RandomState(np.random.randint(2**31) if seed is None else seed)
+
+    @classmethod
+    def from_csv(cls, filename, classification, chunk_size=65536, statistics_files=(), **kwargs):
+        """
+        Streams a CSV file of the data/ layout. Unless given in kwargs, the number of classes or the target
+        statistics of the file and statistics_files are taken from the caches of common.reader when they
+        are up to date, otherwise found with one extra pass over the files.
+        """
+        chunks = lambda: csv_chunks(filename, chunk_size)
+        if 'classes' not in kwargs and 'statistics' not in kwargs:
+            cached = cached_statistics((filename, *statistics_files), classification)
+            if cached is None:
+                cached = stream_statistics(chunks(), *(csv_chunks(f, chunk_size) for f in statistics_files))
+            statistics, labels = cached
+            if classification:
+                kwargs['classes'] = len(labels)
+            else:
+                kwargs['statistics'] = statistics
+        return cls(chunks, **kwargs)
+
+    @classmethod
+    def from_arrays(cls, X, y, chunk_size=65536, **kwargs):
+        return cls(lambda: array_chunks(X, y, chunk_size), **kwargs)
+
+    def normalized(self):
+        for X, y in self.chunks():
+            if self.statistics is not None:
+                minimum, maximum = self.statistics
+                y = (y - minimum) / (maximum - minimum)
+            yield X, y
+
+    def shuffled(self, batch_size):
+        """
+        Yields (X, y) batches. Blocks are collected until buffer_size samples are buffered, the buffer is
+        permuted and emitted as whole batches, and the remainder is carried over to the next buffer.
+        """
+        X_parts, y_parts, buffered = [], [], 0
+        for X, y in self.normalized():
+            X_parts.append(X)
+            y_parts.append(y)
+            buffered += len(X)
+            if buffered < max(self.buffer_size, batch_size):
+                continue
+            X_buffer, y_buffer = np.concatenate(X_parts), np.concatenate(y_parts)
+            if self.buffer_size:
+                permutation = self.random.permutation(buffered)
+                X_buffer, y_buffer = X_buffer[permutation], y_buffer[permutation]
+            end = buffered - buffered % batch_size
+            for start in range(0, end, batch_size):
+                yield X_buffer[start:start + batch_size], y_buffer[start:start + batch_size]
+            X_parts, y_parts, buffered = [X_buffer[end:]], [y_buffer[end:]], buffered - end
+        if buffered:
+            X_buffer, y_buffer = np.concatenate(X_parts), np.concatenate(y_parts)
+            if self.buffer_size:
+                permutation = self.random.permutation(buffered)
+                X_buffer, y_buffer = X_buffer[permutation], y_buffer[permutation]
+            for start in range(0, buffered, batch_size):
+                yield X_buffer[start:start + batch_size], y_buffer[start:start + batch_size]
+
+    def batches(self, batch_size, transform=None):
+        """
+        Args:
+            transform (callable): applied to every (X, y) batch on the background thread
+        """
+        batches = self.shuffled(batch_size)
+        if transform is not None:
+            batches = (transform(X, y) for X, y in batches)
+        return prefetch(batches, self.prefetch_batches)
@@ -1,13 +1,25 @@
+import hashlib
+import json
 import numpy as np
-from datetime import datetime
 import time
-from common.reader import normalize, prepare_data
+from common.early_stopping import EarlyStopping
+from common.profiling import NULL_PROFILER, Profiler
+from common.shared_datasets import get_dataset_pair
 from common.problem_type import problem_type
-from common.graphs import draw_regression, generate_classification_graph_for_model, generate_loss_function_graph, generate_regression_graph
+from common.graphs import classification_surface
+from common.render_queue import classification_plot, loss_plot, regression_plot, render_job, write_job
 
 
 class Test:
-    def __init__(self, mpl, train_dataset_path, test_dataset_path, loss_function1, loss_function2, n_repetition=1, name="test", seed=None):
+    def __init__(self, mpl, train_dataset_path, test_dataset_path, loss_function1, loss_function2, n_repetition=1, name="test", seed=None,
+                 eval_every=1, eval_subsample=None, patience=None):
+        """
+        Args:
+            eval_every (int): score the model every eval_every repetitions (and after the last one)
+            eval_subsample (int): number of train samples, drawn once, used to score the train set; all if None
+            patience (int): stop after this many evaluations without improvement of the test accuracy
+                (classification) or of the first test loss (regression)
+        """
         self.mpl = mpl
         self.n_repetition = n_repetition
         self.train_dataset_path = train_dataset_path
@@ -18,22 +30,63 @@ class Test:
         self.loss_function2 = loss_function2
         self.name = name
         self.seed = seed
+        self.eval_every = eval_every
+        self.eval_subsample = eval_subsample
+        self.patience = patience
+        self.train_eval_dataset = None
+        # no-op until start_profiling, record() then reports no profile
+        self.profiler = NULL_PROFILER
+        # stored plot data written by finish, drawn later by common.render_queue
+        self.plots = []
+        self.results = []
+
+    def config(self):
+        config = {
+            'name': self.name,
+            'problem_type': self.mpl.problem_type.__name__,
+            'layers': list(self.mpl.layers),
+            'bias': bool(self.mpl.bias),
+            'activation_function': self.mpl.activation_function.__name__,
+            'output_function': self.mpl.output_function.__name__,
+            'loss_functions': [self.loss_function1.__name__, self.loss_function2.__name__],
+            'learning_rate': self.mpl.learning_rate,
+            'epochs': self.mpl.epochs,
+            'batch_size': self.mpl.batch_size,
+            'dtype': self.mpl.dtype.name,
+            'repetitions': self.n_repetition,
+            'seed': self.seed,
+            'eval_every': self.eval_every,
+            'eval_subsample': self.eval_subsample,
+            'patience': self.patience,
+            'train_dataset': self.train_dataset_path,
+            'test_dataset': self.test_dataset_path,
+        }
+        # only present when set, so plain SGD runs keep their hashes
+        if self.mpl.optimizer is not None:
+            config['optimizer'] = self.mpl.optimizer.config()
+        return config
+
+    def config_hash(self):
+        return hashlib.sha1(json.dumps(self.config(), sort_keys=True).encode()).hexdigest()
+
+    def start_profiling(self):
+        """
+        Times this run's phases, the summary is returned with the results by record.
+        """
+        self.profiler = Profiler()
+        self.mpl.profiler = self.profiler
 
     def get_data(self):
-        self.train_dataset = prepare_data(self.mpl.problem_type, self.train_dataset_path)
-        self.test_dataset = prepare_data(self.mpl.problem_type, self.test_dataset_path)
-        if self.mpl.problem_type == problem_type.Regression:
-            self.train_dataset, self.test_dataset = normalize(self.train_dataset, self.test_dataset)
-        test_targets = []
-        test_inputs = []
-        for i in range(len(self.test_dataset)):
-            test_targets.append(self.test_dataset[i][1])
-            test_inputs.append(self.test_dataset[i][0])
-        train_targets = []
-        train_inputs = []
-        for i in range(len(self.train_dataset)):
-            train_targets.append(self.train_dataset[i][1])
-            train_inputs.append(self.train_dataset[i][0])
+        with self.profiler.phase('data'):
+            self.train_dataset, self.test_dataset = get_dataset_pair(
+                self.mpl.problem_type, self.train_dataset_path, self.test_dataset_path, self.mpl.dtype)
+        train_inputs, train_targets = self.train_dataset
+        test_inputs, test_targets = self.test_dataset
+        self.train_eval_dataset = self.train_dataset
+        if self.eval_subsample is not None and self.eval_subsample < len(train_inputs):
+            # separate generator, so the subsample does not change the training data order
+            index = np.sort(np.random.RandomState(self.seed).choice(len(train_inputs), self.eval_subsample, replace=False))
+            self.train_eval_dataset = (train_inputs[index], train_targets[index])
         return train_inputs, train_targets, test_inputs, test_targets
 
     def classification_accuracy(self, predictions, test_targets):
@@ -43,52 +96,78 @@ class Test:
     def start(self):
         results = []
         np.random.seed(self.seed)
-        train_inputs, train_targets, test_inputs, test_targets = self.get_data()
+        self.start_profiling()
+        self.get_data()
+        early_stopping = self.early_stopping()
         for i in range(self.n_repetition):
             self.mpl.train(self.train_dataset, -1)
+            if not self.should_evaluate(i):
+                continue
+            result, predictions = self.evaluate(i)
+            results.append(result)
+            if early_stopping is not None and early_stopping.update(self.tracked_metric(result), i):
+                break
+        self.finish(results, predictions)
+
+    def should_evaluate(self, i):
+        return (i+1) % self.eval_every == 0 or i == self.n_repetition - 1
+
+    def early_stopping(self):
+        if self.patience is None:
+            return None
+        if self.mpl.problem_type == problem_type.Regression:
+            return EarlyStopping(self.patience, 'min')
+        return EarlyStopping(self.patience, 'max')
+
+    def tracked_metric(self, result):
+        if self.mpl.problem_type == problem_type.Regression:
+            return result[1]
+        return result[5]
+
+    def evaluate(self, i):
+        """
+        Scores the model after repetition i, returns the results row and the test set predictions.
+        """
+        train_inputs, train_targets = self.train_eval_dataset
+        test_inputs, test_targets = self.test_dataset
+        with self.profiler.phase('evaluation'):
             predictions = self.mpl.predict_list(test_inputs)
             loss1 = self.loss_function1(predictions, test_targets)
             loss2 = self.loss_function2(predictions, test_targets)
             t_predictions = self.mpl.predict_list(train_inputs)
             t_loss1 = self.loss_function1(t_predictions, train_targets)
             t_loss2 = self.loss_function2(t_predictions, train_targets)
-            if self.mpl.problem_type == problem_type.Regression:
-                results.append(((i+1)*self.mpl.epochs, loss1, loss2, t_loss1, t_loss2))
-            else:
-                accuracy = self.classification_accuracy(predictions, test_targets)
-                results.append(((i+1)*self.mpl.epochs, loss1, loss2, t_loss1, t_loss2, accuracy))
-        # print("saving to file")
-        # timestr = time.strftime("%d_%m_%Y-%H_%M-%S")
-        self.save_to_file(results, f'data/results/{self.name}.csv')
-        self.draw_graphs(results, predictions, 'data/results/graphs/')
-
-
-
-    def save_to_file(self, results, file_path):
-        f = open(file_path, "w")
-        print("saving", self.name)
-        f.write(f"Train dataset: {self.train_dataset_path}\n")
-        f.write(f"Test dataset: {self.test_dataset_path}\n")
-        f.write(f"Layers: {self.mpl.layers}\n")
-        f.write(f"Test dataset: {1 if self.mpl.bias else 0}\n")
-        f.write(f"Seed: {self.seed}\n")
-        f.write(f"Learning rate: {self.mpl.learning_rate}\n")
-        f.write(f"Activation function: {self.mpl.activation_function.__name__}\n")
-        f.write(f"Output function: {self.mpl.output_function.__name__}\n")
-        f.write(f"Problem type: {self.mpl.problem_type.__name__}\n")
-        f.write(f"Epochs: {self.mpl.epochs * self.n_repetition}\n")
-        if self.mpl.problem_type == problem_type.Regression:
-            f.write(f"Epochs;Loss ({self.loss_function1.__name__});Loss ({self.loss_function2.__name__})\n")
-            results = [f'{str(results[i][0])};{str(results[i][1])};{str(results[i][2])}\n'
-                    for i in range(len(results))]
-        else:
-            f.write(f"Epochs;Loss ({self.loss_function1.__name__});Loss ({self.loss_function2.__name__});Accuracy\n")
-            results = [f'{str(results[i][0])};{str(results[i][1])};{str(results[i][2])};{str(results[i][5])}\n'
-                    for i in range(len(results))]
-        f.writelines(results)
-        f.close
+        result = ((i+1)*self.mpl.epochs, loss1, loss2, t_loss1, t_loss2)
+        metrics = {'loss1': float(loss1), 'loss2': float(loss2), 'train_loss1': float(t_loss1), 'train_loss2': float(t_loss2)}
+        if self.mpl.problem_type == problem_type.Classification:
+            result += (self.classification_accuracy(predictions, test_targets),)
+            metrics['accuracy'] = float(result[5])
+        for callback in self.mpl.callbacks:
+            callback.on_evaluation(self.mpl, metrics)
+        return result, predictions
 
-    def draw_graphs(self, results, predictions, path):
+    def finish(self, results, predictions):
+        # the results are collected through record() into common.results_store
+        self.results = results
+        self.plots = [write_job(job) for job in self.plot_jobs(results, predictions, 'data/results/graphs/')]
+
+    def record(self):
+        """
+        Returns (config hash, config, metric rows, profile) of the finished run, see ResultsStore.add_run.
+        """
+        metrics = []
+        for result in self.results:
+            row = {'epoch': result[0], 'loss1': float(result[1]), 'loss2': float(result[2]),
+                   'train_loss1': float(result[3]), 'train_loss2': float(result[4])}
+            if len(result) > 5:
+                row['accuracy'] = float(result[5])
+            metrics.append(row)
+        return self.config_hash(), self.config(), metrics, self.profiler.summary()
+
+    def plot_jobs(self, results, predictions, path):
+        """
+        Returns the data of the loss plots and of the regression or decision surface plot, see common.render_queue.
+        """
         epochs = []
         train_loss1 = []
         train_loss2 = []
@@ -100,9 +179,15 @@ class Test:
             train_loss2.append(results[i][4])
             test_loss1.append(results[i][1])
             test_loss2.append(results[i][2])
-        generate_loss_function_graph(epochs, train_loss1, test_loss1, self.loss_function1.__name__, f'{path}{self.name}_loss1.png')
-        generate_loss_function_graph(epochs, train_loss2, test_loss2, self.loss_function2.__name__, f'{path}{self.name}_loss2.png')
+        jobs = [loss_plot(epochs, train_loss1, test_loss1, self.loss_function1.__name__, f'{path}{self.name}_loss1.png'),
+                loss_plot(epochs, train_loss2, test_loss2, self.loss_function2.__name__, f'{path}{self.name}_loss2.png')]
         if self.mpl.problem_type == problem_type.Regression:
-            draw_regression(self.train_dataset, self.test_dataset, predictions, f'{path}{self.name}_result.png')
+            jobs.append(regression_plot(self.train_dataset, self.test_dataset, predictions, f'{path}{self.name}_result.png'))
         else:
-            generate_classification_graph_for_model(self.mpl, self.train_dataset, self.test_dataset, f'{path}{self.name}_result.png')
+            x1grid, x2grid, zz = classification_surface(self.mpl, self.train_dataset)
+            jobs.append(classification_plot(x1grid, x2grid, zz, self.train_dataset, f'{path}{self.name}_result.png'))
+        return jobs
+
+    def draw_graphs(self, results, predictions, path):
+        for job in self.plot_jobs(results, predictions, path):
+            render_job(job)
@@ -0,0 +1,192 @@
+import numpy as np
+from common.dataset import split_dataset
+from common.problem_type import problem_type
+from common.profiling import Profiler
+
+
+class MLPEnsemble:
+    """
+    Trains several MLPs of the same topology in lockstep. The weights of layer l are stored as one
+    (N, in, out) stack and every forward and backward pass is a batched matmul over all models.
+    """
+
+    def __init__(self, models):
+        """
+        Args:
+            models (list): MLPs with the same layers, problem type, epochs, batch size and dtype;
+                activation functions, output functions, learning rates and biases may differ; the loss
+                must be None or cross entropy on a softmax output
+        """
+        first = models[0]
+        for model in models:
+            if list(model.layers) != list(first.layers) or model.problem_type != first.problem_type \
+                    or model.epochs != first.epochs or model.batch_size != first.batch_size \
+                    or model.dtype != first.dtype:
+                raise ValueError('All models of an ensemble must share topology and training settings')
+            if model.optimizer is not None:
+                raise ValueError('Ensembles train with plain SGD, the models must not have an optimizer')
+            if model.loss_function is not None and not model.fuses_softmax_cross_entropy():
+                raise ValueError('Ensembles propagate output - target, the models must have no loss function '
+                                 'or softmax with cross entropy')
+        self.models = models
+        self.problem_type = first.problem_type
+        self.layers = first.layers
+        self.epochs = first.epochs
+        self.batch_size = first.batch_size
+        self.dtype = first.dtype
+
+        n = len(models)
+        self.learning_rates = np.array([m.learning_rate for m in models], self.dtype).reshape(n, 1, 1)
+        self.bias_mask = np.array([m.bias for m in models], self.dtype).reshape(n, 1, 1)
+        self.bias_rates = self.learning_rates * self.bias_mask
+        self.active = [True for _ in models]
+        self.weights = []
+        self.biases = []
+        for i in range(len(self.layers) - 1):
+            self.weights.append(np.stack([m.weights[i] for m in models]))
+            biases = np.zeros((n, 1, self.layers[i + 1]), self.dtype)
+            for j, m in enumerate(models):
+                if m.bias:
+                    biases[j, 0] = m.biases[i]
+            self.biases.append(biases)
+        self.activation_groups = self.group_functions([m.activation_function for m in models])
+        self.output_groups = self.group_functions([m.output_function for m in models])
+
+    @staticmethod
+    def group_functions(functions):
+        """
+        Returns a list of (function, index) where index selects the models using the function.
+        """
+        names = [f.__name__ for f in functions]
+        groups = []
+        for name in dict.fromkeys(names):
+            index = [i for i, n in enumerate(names) if n == name]
+            if len(index) == len(names):
+                index = slice(None)
+            groups.append((functions[names.index(name)], index))
+        return groups
+
+    @staticmethod
+    def apply_groups(groups, tmp):
+        for function, index in groups:
+            if isinstance(index, slice):
+                function(tmp, out=tmp)
+            else:
+                tmp[index] = function(tmp[index])
+        return tmp
+
+    def feed_forward(self, data):
+        """
+        Args:
+            data (array): (batch, in) inputs shared by all models or (N, batch, in) inputs per model
+
+        Returns:
+            list of (N, batch, size) outputs of every layer
+        """
+        tmp = np.asarray(data, dtype=self.dtype)
+        output = [tmp]
+        for i in range(len(self.weights)):
+            tmp = np.matmul(tmp, self.weights[i])
+            tmp += self.biases[i]
+            if i < (len(self.weights) - 1):
+                self.apply_groups(self.activation_groups, tmp)
+            else:
+                self.apply_groups(self.output_groups, tmp)
+            output.append(tmp)
+        return output
+
+    def compute_gradients(self, outputs, result):
+        """
+        Returns the (N, in, out) weight and (N, 1, out) bias steps of every layer, already scaled
+        by the learning rates of the models.
+        """
+        # same batch averaged error as MLP.output_delta
+        delta = outputs[-1] - np.asarray(result, dtype=self.dtype)
+        delta /= delta.shape[1]
+        D_weights = [None] * len(self.weights)
+        D_biases = [None] * len(self.weights)
+        for layer in range(len(self.weights) - 1, -1, -1):
+            # the inputs of the first layer are (batch, in) and broadcast over the models
+            D_weights[layer] = np.matmul(np.swapaxes(outputs[layer], -1, -2), delta)
+            D_weights[layer] *= self.learning_rates
+            D_biases[layer] = np.sum(delta, axis=1, keepdims=True)
+            D_biases[layer] *= self.bias_rates
+            if layer > 0:
+                delta = np.matmul(delta, self.weights[layer].transpose(0, 2, 1))
+                for activation, index in self.activation_groups:
+                    if isinstance(index, slice):
+                        activation.backward(outputs[layer], delta)
+                    else:
+                        delta[index] = activation.backward(outputs[layer][index], delta[index])
+        return D_weights, D_biases
+
+    def apply_gradients(self, D_weights, D_biases):
+        for layer in range(len(self.weights)):
+            self.weights[layer] -= D_weights[layer]
+            self.biases[layer] -= D_biases[layer]
+
+    def backpropagation(self, outputs, result):
+        self.apply_gradients(*self.compute_gradients(outputs, result))
+
+    def train(self, dataset, category_shift=1, shuffle=True):
+        """
+        Same schedule as MLP.train: one shuffle per call, then self.epochs passes over the data.
+        The phases are timed once for the whole ensemble and split evenly between the profilers of
+        the models still training, each of which counts every trained sample.
+        """
+        profiler = Profiler()
+        with profiler.phase('data'):
+            X, Y = self.models[0].prepare_training_data(dataset, category_shift)
+            if shuffle:
+                permutation = np.random.permutation(len(X))
+                X, Y = X[permutation], Y[permutation]
+        for i in range(self.epochs):
+            for start in range(0, len(X), self.batch_size):
+                end = start + self.batch_size
+                with profiler.phase('forward'):
+                    outputs = self.feed_forward(X[start:end])
+                with profiler.phase('backward'):
+                    gradients = self.compute_gradients(outputs, Y[start:end])
+                with profiler.phase('update'):
+                    self.apply_gradients(*gradients)
+                profiler.count(len(outputs[0]))
+        self.share_profile(profiler)
+
+    def share_profile(self, profiler):
+        active = [m for m, a in zip(self.models, self.active) if a and m.profiler is not None]
+        for model in active:
+            model.profiler.merge(profiler, 1 / len(active))
+
+    def predict_batch(self, data, category_shift=1, raw=False):
+        outputs = self.feed_forward(np.atleast_2d(data))[-1]
+        if raw or self.problem_type != problem_type.Classification:
+            return outputs
+        return np.argmax(outputs, axis=2) + category_shift
+
+    def losses(self, dataset, category_shift=1):
+        """
+        Returns the value of every model's own loss function on the dataset.
+        """
+        X, y = split_dataset(dataset)
+        predictions = self.predict_batch(X, category_shift)
+        return [m.loss_function(p, y) for m, p in zip(self.models, predictions)]
+
+    def freeze(self, j):
+        """
+        Stops updating the parameters of model j, e.g. once it reached its early stopping point.
+        Its rows are still computed with the others, but the zero rates leave them unchanged.
+        """
+        self.learning_rates[j] = 0
+        self.bias_rates[j] = 0
+        self.active[j] = False
+
+    def store(self):
+        """
+        Copies the trained parameters back into the member MLPs.
+        """
+        for j, model in enumerate(self.models):
+            for i in range(len(self.weights)):
+                model.weights[i][:] = self.weights[i][j]
+                if model.bias:
+                    model.biases[i][:] = self.biases[i][j, 0]
+        return self.models
@@ -1,72 +1,48 @@
-import ssl
+import hashlib
 import time
-from tensorflow.keras.datasets import mnist
-# from tensorflow import keras
-from matplotlib import pyplot
+from common.checkpoint import load_checkpoint, random_state, restore_random_state, save_checkpoint
+from common.early_stopping import EarlyStopping
 from common.functions import function_type
+from common.mnist_preprocessing import augmented_chunks, cached_preprocess
+from common.mnist_reader import load_mnist
 from common.problem_type import problem_type
+from common.profiling import Profiler, TargetAccuracy
+from common.results_store import ResultsStore
+from common.stream import DataStream
 from perceptron import MLP
 import numpy as np
-import requests
-requests.packages.urllib3.disable_warnings()
 
 
-def invert_images(images):
-    for img in images:
-        img = 255 - img
-    return images
-
-
-def threshold_images(images, threshold):
-    for img in images:
-        img[img > threshold] = 255
-        img[img <= threshold] = 0
-    return images
-
-
-try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    # Legacy Python that doesn't verify HTTPS certificates by default
-    pass
-else:
-    # Handle target environment that doesn't support HTTPS verification
-    ssl._create_default_https_context = _create_unverified_https_context
-
-# train_X - list with MNIST training images
-# train_y - list of labels of MNIST training images
-# test_X - list with MNIST testing images
-# test_y - list of labels of MN IST testing images
-(train_X, train_y), (test_X, test_y) = mnist.load_data()
+# train_X - (N, 784) memory mapped MNIST training images
+# train_y - labels of MNIST training images
+# test_X - (N, 784) memory mapped MNIST testing images
+# test_y - labels of MNIST testing images
+# The arrays are read-only, the preprocessing below writes its results to separate cached files
+(train_X, train_y), (test_X, test_y) = load_mnist(mmap_mode='r')
 
 TAKE_PART = 1
 INVERT = False
 THRESHOLD = False
 THRESHOLD_VALUE = 127
-
-if INVERT:
-    train_X = invert_images(train_X)
-    test_X = invert_images(test_X)
-
-if THRESHOLD:
-    train_X = threshold_images(train_X, THRESHOLD_VALUE)
-    test_X = threshold_images(test_X, THRESHOLD_VALUE)
-
-train_dataset = []
-# r = len(train_X)
-r_train = int(len(train_X)/TAKE_PART)
-for idx in range(r_train):
-    # for idx in range(300):
-    train_dataset.append([np.array(train_X[idx].flatten()), train_y[idx]])
-test_dataset = []
-# r = len(test_X)
-r_test = int(len(test_X)/TAKE_PART)
-for idx in range(r_test):
-    # for idx in range(10):
-    test_dataset.append([np.array(test_X[idx].flatten()), test_y[idx]])
+DTYPE = np.float32
+BATCH_SIZE = 64 # samples per forward and backward pass
+SCALE = False # scale the pixels to [0, 1]
+AUGMENT = False # train on randomly shifted and rotated images, new ones every epoch (implies STREAM)
+MAX_SHIFT = 2 # pixels
+MAX_ROTATION = 10 # degrees
+STREAM = False # train from the memory maps through common.stream instead of an in-memory list
+STREAM_BUFFER = 10000
+
+# whole-array transforms, cached in data/mnist/preprocessed
+preprocessing = {'invert_images': INVERT, 'threshold_value': THRESHOLD_VALUE if THRESHOLD else None,
+                 'scale': SCALE, 'dtype': DTYPE}
+train_X = cached_preprocess(train_X, **preprocessing)
+test_X = cached_preprocess(test_X, **preprocessing)
 
 image_len = 28 * 28
 classes_no = unique = len(np.unique(train_y))
+r_train = int(len(train_X)/TAKE_PART)
+r_test = int(len(test_X)/TAKE_PART)
 PROBLEM_TYPE = problem_type.Classification
 ACTIVATION_FUNCTION = function_type.Sigmoid
 OUTPUT_FUNCTION = function_type.Softmax
@@ -74,52 +50,135 @@ LOSS_FUNCTION = function_type.Cross_entropy
 # LAYERS = [image_len, classes_no]
 LAYERS = [image_len, 512, classes_no]
 EPOCHS = 1000
-LEARINN_RATE = 0.0003
+# the gradient is averaged over a batch, so plain SGD scales the rate linearly to keep the
+# per-sample step of 0.0003 (set the rate of an adaptive OPTIMIZER directly)
+LEARINN_RATE = 0.0003 * BATCH_SIZE
 SEED = 51
 SHOW_PERCENTAGE = 10
 BIAS = False
-
-def save_to_file_header(path):
-    f = open(path, "w")
-    f.write(f"Layers: {LAYERS}\n")
-    f.write(f"Seed: {SEED}\n")
-    f.write(f"Learning rate: {LEARINN_RATE}\n")
-    f.write(f"Activation function: {ACTIVATION_FUNCTION.__name__}\n")
-    f.write(f"Output function: {OUTPUT_FUNCTION.__name__}\n")
-    f.write(f"Epochs: {EPOCHS}\n")
-    f.write(f"BIAS: {BIAS}\n")
-    f.write(f"Inverted: {INVERT}\n")
-    f.write(f"Thresholded: {THRESHOLD}\n")
-    f.write(f"Threshold_value: {THRESHOLD_VALUE}\n")
-    if TAKE_PART != 1:
-        f.write(f"Part of dataset: {TAKE_PART}\n")
-    f.write(f"Epochs;Accuracy;MAX_Epoch;MAX\n")
-    f.close
-
-def save_to_file_rate(path, rate):
-    f = open(path, "a")
-    f.write(f'{str(rate[0])};{str(rate[1])};{str(rate[2])};{str(rate[3])}\n')
-    f.close
+EVAL_EVERY = 1 # score the test set every EVAL_EVERY epochs
+PATIENCE = None # stop after PATIENCE evaluations without a new best accuracy, None to disable
+# plain SGD, or one of common.optimizers, e.g. common.optimizers.Adam() or
+# common.optimizers.SGD(momentum=0.9, schedule=common.optimizers.CosineSchedule(EPOCHS * r_train // BATCH_SIZE))
+# after `import common.optimizers`
+OPTIMIZER = None
+TARGET_ACCURACY = None # report the wall time until the test accuracy first reaches this value
+RESULTS_DB = 'mnist/results.sqlite' # accuracy of every evaluated epoch, one run per results path
+RESUME = None # path to a checkpoint (mnist/BIG_MNIST_*.ckpt) to continue training from
+
+# rows of the memory maps are views, MLP converts them to DTYPE in one pass
+if AUGMENT:
+    # augmented on the prefetch thread of the stream while the model trains on the previous batches
+    augmentation = np.random.RandomState(SEED)
+    train_dataset = DataStream(lambda: augmented_chunks(train_X[:r_train], train_y[:r_train], augmentation,
+                                                        max_shift=MAX_SHIFT, max_rotation=MAX_ROTATION),
+                               classes=classes_no, buffer_size=STREAM_BUFFER, seed=SEED)
+elif STREAM:
+    # read in blocks straight from the memory maps, shuffled within STREAM_BUFFER images
+    train_dataset = DataStream.from_arrays(train_X[:r_train], train_y[:r_train], classes=classes_no,
+                                           buffer_size=STREAM_BUFFER, seed=SEED)
+else:
+    # converted once by the model (MLP.prepare_dataset) before training
+    train_dataset = (train_X[:r_train], train_y[:r_train])
+# generators besides the global one which the training consumes, checkpointed for an exact resume
+random_generators = {}
+if isinstance(train_dataset, DataStream):
+    random_generators['stream'] = train_dataset.random
+if AUGMENT:
+    random_generators['augmentation'] = augmentation
+test_dataset = (test_X[:r_test], test_y[:r_test])
+
+def run_config(path):
+    config = {
+        'name': path,
+        'problem_type': PROBLEM_TYPE.__name__,
+        'layers': LAYERS,
+        'seed': SEED,
+        'learning_rate': LEARINN_RATE,
+        'activation_function': ACTIVATION_FUNCTION.__name__,
+        'output_function': OUTPUT_FUNCTION.__name__,
+        'loss_functions': [LOSS_FUNCTION.__name__],
+        'epochs': EPOCHS,
+        'bias': BIAS,
+        'inverted': INVERT,
+        'thresholded': THRESHOLD,
+        'threshold_value': THRESHOLD_VALUE,
+        'scaled': SCALE,
+        'augmented': {'max_shift': MAX_SHIFT, 'max_rotation': MAX_ROTATION} if AUGMENT else None,
+        'dtype': np.dtype(DTYPE).name,
+        'batch_size': BATCH_SIZE,
+        'optimizer': OPTIMIZER.config() if OPTIMIZER is not None else None,
+        'take_part': TAKE_PART,
+        'train_dataset': 'mnist',
+        'test_dataset': 'mnist',
+    }
+    return hashlib.sha1(path.encode()).hexdigest(), config
+
+def save_state(perceptron, path, max, max_epoch, early_stopping):
+    # called between epochs, when the stream's background thread has finished using the generators
+    extra = {'results_path': path, 'max': max, 'max_epoch': max_epoch, 'random_states': {}}
+    arrays = {}
+    for name, random in random_generators.items():
+        extra['random_states'][name], arrays[f'random.{name}'] = random_state(random.get_state())
+    if early_stopping is not None:
+        extra['early_stopping'] = vars(early_stopping)
+    save_checkpoint(perceptron, f'{path}.ckpt', extra, arrays)
 
 
 if __name__ == "__main__":
     perceptron = MLP(PROBLEM_TYPE, LAYERS, ACTIVATION_FUNCTION,
-                     OUTPUT_FUNCTION, LOSS_FUNCTION, 1, LEARINN_RATE, SEED, BIAS)
-
-    timestr = time.strftime("%d_%m_%Y-%H_%M-%S")
-    path = f"mnist/BIG_MNIST_{timestr}"
-    save_to_file_header(path)
+                     OUTPUT_FUNCTION, LOSS_FUNCTION, 1, LEARINN_RATE, SEED, BIAS,
+                     batch_size=BATCH_SIZE, dtype=DTYPE, optimizer=OPTIMIZER)
 
     max = 0
     max_epoch = 0
-    np.random.shuffle(train_dataset)
-    for i in range(EPOCHS):
+    early_stopping = EarlyStopping(PATIENCE, 'max') if PATIENCE is not None else None
+    if RESUME is None:
+        timestr = time.strftime("%d_%m_%Y-%H_%M-%S")
+        path = f"mnist/BIG_MNIST_{timestr}"
+    else:
+        perceptron, header, arrays = load_checkpoint(RESUME)
+        extra = header['extra']
+        path, max, max_epoch = extra['results_path'], extra['max'], extra['max_epoch']
+        random_states = extra.get('random_states', {})
+        for name, random in random_generators.items():
+            if name in random_states:
+                random.set_state(restore_random_state(random_states[name], arrays[f'random.{name}']))
+            else:
+                print(f"The checkpoint has no {name} generator state, the resumed {name} order will differ")
+        if early_stopping is not None and 'early_stopping' in extra:
+            vars(early_stopping).update(extra['early_stopping'])
+        print(f"Resuming {path} after epoch {perceptron.epoch}")
+    store = ResultsStore(RESULTS_DB)
+    run_hash, config = run_config(path)
+    store.add_run(run_hash, config)
+    # contiguous inputs and one hot targets built once, train reshuffles them every epoch with
+    # the global RNG, whose state is kept in the checkpoints
+    if isinstance(train_dataset, tuple):
+        train_dataset = perceptron.prepare_dataset(train_dataset, category_shift=0)
+    test_dataset = perceptron.prepare_dataset(test_dataset, category_shift=0)
+    # phase timings, throughput and peak memory, stored with the run after every epoch
+    perceptron.profiler = Profiler()
+    if TARGET_ACCURACY is not None:
+        perceptron.callbacks.append(TargetAccuracy(TARGET_ACCURACY))
+    for i in range(perceptron.epoch, EPOCHS):
         print("Epoch:", i+1)
-        perceptron.train(train_dataset, category_shift=0, shuffle=False)
-        rate, _, _ = perceptron.test(
-            test_dataset, SHOW_PERCENTAGE, category_shift=0)
-        if rate > max :
-            max = rate
-            max_epoch = i+1
-        save_to_file_rate(path,(i+1, rate, max_epoch, max))
+        perceptron.train(train_dataset, category_shift=0)
+        stop = False
+        if (i+1) % EVAL_EVERY == 0 or i == EPOCHS - 1:
+            rate, _, _ = perceptron.test(
+                test_dataset, SHOW_PERCENTAGE, category_shift=0)
+            if rate > max :
+                max = rate
+                max_epoch = i+1
+            store.add_metrics(run_hash, [{'epoch': i+1, 'accuracy': rate}])
+            stop = early_stopping is not None and early_stopping.update(rate, i+1)
+        store.add_run(run_hash, config, profile=perceptron.profiler.summary())
+        # commit the results of the epoch before the checkpoint which allows resuming after it
+        store.flush()
+        save_state(perceptron, path, max, max_epoch, early_stopping)
+        if stop:
+            print(f"Early stopping, best accuracy {early_stopping.best}% in epoch {early_stopping.best_step}")
+            break
+    store.close()
 
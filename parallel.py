@@ -0,0 +1,183 @@
+import argparse
+import multiprocessing
+import time
+import numpy as np
+from common.shared_datasets import attach_array, release, share_array
+
+
+def batch_shards(start, end, workers):
+    """
+    Splits the rows [start, end) of a batch into one contiguous shard per worker.
+    """
+    bounds = np.linspace(start, end, workers + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def shared_worker(update, rank, workers, model, descriptors, barrier):
+    memories = []
+    arrays = {}
+    try:
+        for name, descriptor in descriptors.items():
+            arrays[name] = attach_array(descriptor, memories, writeable=name in ('parameters', 'gradients'))
+        update(rank, workers, model, arrays, barrier)
+    except BaseException:
+        if barrier is not None:
+            barrier.abort()
+        raise
+    finally:
+        del model
+        arrays.clear()
+        release(memories)
+
+
+def train_shared(model, dataset, update, workers=None, category_shift=1, shuffle=True, synchronized=False):
+    """
+    Common part of train_data_parallel and train_hogwild. The prepared dataset is shuffled once and
+    published with the parameters in shared memory, then update(rank, workers, model, arrays, barrier)
+    runs in one process per worker and the model gets the shared parameters back.
+    Set OMP_NUM_THREADS=1 (or the BLAS equivalent) to keep the workers from oversubscribing the cores.
+
+    Args:
+        update (function): the training loop of one worker, arrays maps 'parameters', 'X', 'Y'
+            (and 'gradients') to the shared arrays
+        workers (int): number of processes, all cores by default
+        synchronized (bool): also share one gradient row per worker and a barrier
+    """
+    if model.optimizer is not None:
+        raise ValueError('Parallel training uses plain SGD, the model must not have an optimizer')
+    workers = workers or multiprocessing.cpu_count()
+    X_data, Y_data = model.prepare_training_data(dataset, category_shift)
+    if shuffle:
+        permutation = np.random.permutation(len(X_data))
+        X_data, Y_data = X_data[permutation], Y_data[permutation]
+
+    memories = []
+    try:
+        parameters, parameters_descriptor = share_array(model.parameters, memories)
+        descriptors = {'parameters': parameters_descriptor,
+                       'X': share_array(X_data.astype(model.dtype, copy=False), memories)[1],
+                       'Y': share_array(Y_data.astype(model.dtype, copy=False), memories)[1]}
+        barrier = None
+        if synchronized:
+            descriptors['gradients'] = share_array(
+                np.zeros((workers,) + model.parameters.shape, model.dtype), memories)[1]
+            barrier = multiprocessing.Barrier(workers)
+
+        processes = [multiprocessing.Process(target=shared_worker,
+                                             args=(update, rank, workers, model, descriptors, barrier))
+                     for rank in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            raise RuntimeError(f'A worker of {update.__name__} failed')
+        model.parameters[:] = parameters
+        model.epoch += model.epochs
+    finally:
+        release(memories, unlink=True)
+    return model
+
+
+def data_parallel_update(rank, workers, model, arrays, barrier):
+    parameters, gradients, X, Y = arrays['parameters'], arrays['gradients'], arrays['X'], arrays['Y']
+    model.bind_parameters(parameters, gradients[rank])
+    # every worker reduces and updates its own slice of the parameters
+    own = slice(*batch_shards(0, len(parameters), workers)[rank])
+    for _ in range(model.epochs):
+        for start in range(0, len(X), model.batch_size):
+            end = min(start + model.batch_size, len(X))
+            shards = batch_shards(start, end, workers)
+            shard_start, shard_end = shards[rank]
+            if shard_end > shard_start:
+                output, z = model.feed_forward(X[shard_start:shard_end])
+                model.compute_gradients(output, z, Y[shard_start:shard_end])
+            else:
+                model.gradients[:] = 0
+            barrier.wait()
+            # allreduce: average of the shard gradients weighted by the shard sizes
+            weights = np.array([(e - s) / (end - start) for s, e in shards], parameters.dtype)
+            parameters[own] -= model.learning_rate * np.dot(weights, gradients[:, own])
+            barrier.wait()
+
+
+def train_data_parallel(model, dataset, workers=None, category_shift=1, shuffle=True):
+    """
+    Synchronous data-parallel version of MLP.train. Every batch of model.batch_size rows is split
+    between the worker processes, which compute gradients on a shared-memory copy of the parameters;
+    the gradients are averaged (each worker reducing a slice of the parameter vector) before the update.
+    See train_shared for the arguments.
+    """
+    return train_shared(model, dataset, data_parallel_update, workers, category_shift, shuffle, synchronized=True)
+
+
+def hogwild_update(rank, workers, model, arrays, barrier):
+    X, Y = arrays['X'], arrays['Y']
+    # private gradient buffer, the updates go straight into the shared parameters without locking
+    model.bind_parameters(arrays['parameters'])
+    start, end = batch_shards(0, len(X), workers)[rank]
+    for _ in range(model.epochs):
+        for batch_start in range(start, end, model.batch_size):
+            batch_end = min(batch_start + model.batch_size, end)
+            output, z = model.feed_forward(X[batch_start:batch_end])
+            model.backpropagation(output, z, Y[batch_start:batch_end])
+
+
+def train_hogwild(model, dataset, workers=None, category_shift=1, shuffle=True):
+    """
+    Hogwild-style asynchronous SGD: every worker process runs the usual update loop of MLP.train
+    on its own slice of the shuffled dataset and writes into the shared parameters without any locking.
+    The model ends up holding the parameters all workers wrote to. Unlike train_data_parallel the
+    result is not deterministic. See train_shared for the arguments.
+    """
+    return train_shared(model, dataset, hogwild_update, workers, category_shift, shuffle)
+
+
+def benchmark(make_model, train_dataset, test_dataset, workers, category_shift=0, seed=0):
+    """
+    Trains the same model serially, with train_data_parallel and with train_hogwild and
+    returns a list of (mode, seconds, accuracy).
+    """
+    modes = [('serial', lambda m: m.train(train_dataset, -1, category_shift)),
+             ('data parallel', lambda m: train_data_parallel(m, train_dataset, workers, category_shift)),
+             ('hogwild', lambda m: train_hogwild(m, train_dataset, workers, category_shift))]
+    results = []
+    for name, train in modes:
+        model = make_model()
+        np.random.seed(seed)
+        start = time.perf_counter()
+        train(model)
+        seconds = time.perf_counter() - start
+        rate, _, _ = model.test(test_dataset, -1, category_shift)
+        results.append((name, seconds, rate))
+    return results
+
+
+if __name__ == '__main__':
+    from common.functions import function_type
+    from common.mnist_reader import load_mnist
+    from common.problem_type import problem_type
+    from perceptron import MLP
+
+    parser = argparse.ArgumentParser(description='Compares serial, data-parallel and Hogwild training on MNIST')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--train-size', type=int, default=60000)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--hidden', type=int, default=128)
+    args = parser.parse_args()
+    if args.batch_size < args.workers:
+        # data-parallel training splits every batch between the workers
+        parser.error(f'--batch-size ({args.batch_size}) must be at least --workers ({args.workers})')
+
+    (train_X, train_y), (test_X, test_y) = load_mnist()
+    train_dataset = (np.asarray(train_X[:args.train_size], np.float32) / 255, train_y[:args.train_size])
+    test_dataset = (np.asarray(test_X, np.float32) / 255, test_y)
+
+    def make_model():
+        return MLP(problem_type.Classification, [784, args.hidden, 10], function_type.Sigmoid,
+                   function_type.Softmax, function_type.Cross_entropy, args.epochs, 0.1, 1,
+                   batch_size=args.batch_size, dtype=np.float32)
+
+    for name, seconds, rate in benchmark(make_model, train_dataset, test_dataset, args.workers):
+        print(f'{name:>14}: {seconds:8.2f} s, accuracy {rate:.2f}%')
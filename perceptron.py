@@ -1,5 +1,9 @@
+import copy
 import numpy as np
-from common.functions import cross_entropy, mse
+from common.dataset import PreparedDataset, split_dataset
+from common.stream import DataStream
+from common.functions import softmax_cross_entropy
+from common.profiling import NULL_PROFILER
 from common.problem_type import problem_type
 
 
@@ -8,15 +12,19 @@ class MLP:
     Neural Network Class
     """
 
-    def __init__(self, problem_type, layers, activation_function, output_function, loss_function, epochs, learning_rate, seed, bias=False):
+    def __init__(self, problem_type, layers, activation_function, output_function, loss_function, epochs, learning_rate, seed, bias=False, batch_size=1, dtype=np.float64, optimizer=None):
         """
         Args:
             layers (list): list of layers in the network
-            activation_function (function): sigmoid function used in the internal neurons of the network
-            transfer_function (function): activation function used on the output layer
+            activation_function (Activation): sigmoid function used in the internal neurons of the network
+            output_function (Activation): activation function used on the output layer
             epochs (int): number of epochs to learn
             learning_rate (float): learning rate coefficient
             seed (int): number used as a seed for random number generator
+            bias (bool): whether the layers use biases
+            batch_size (int): number of samples processed in one forward and backward pass
+            dtype (type): floating point type of the parameters and of all computations (e.g. np.float32)
+            optimizer (Optimizer): update rule from common.optimizers, plain SGD if None
         """
         np.random.seed(seed)
         self.problem_type = problem_type
@@ -27,17 +35,95 @@ class MLP:
         self.epochs = epochs
         self.learning_rate = learning_rate
         self.bias = bias
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype)
+        self.optimizer = optimizer
+        # number of epochs trained so far, kept in checkpoints
+        self.epoch = 0
+        # common.profiling.Callback objects and an optional common.profiling.Profiler
+        self.callbacks = []
+        self.profiler = None
 
-        self.weights = []
-        self.biases = []
+        self.bind_parameters(np.empty(self.parameters_count(), self.dtype))
         for i in range(len(layers)-1):
             if self.bias:
                 b = np.random.randn(layers[i + 1])
-                self.biases.append(b / np.sqrt(layers[i + 1]))
+                self.biases[i][:] = b / np.sqrt(layers[i + 1])
             w = np.random.randn(layers[i], layers[i + 1])
-            self.weights.append(w / np.sqrt(layers[i]))
+            self.weights[i][:] = w / np.sqrt(layers[i])
+
+    def parameters_count(self):
+        count = 0
+        for i in range(len(self.layers)-1):
+            count += self.layers[i] * self.layers[i + 1]
+            if self.bias:
+                count += self.layers[i + 1]
+        return count
+
+    def layer_views(self, buffer):
+        """
+        Splits a flat buffer into per-layer weight and bias views (layer by layer: weights, then biases).
+        """
+        weights = []
+        biases = []
+        offset = 0
+        for i in range(len(self.layers)-1):
+            size = self.layers[i] * self.layers[i + 1]
+            weights.append(buffer[offset:offset + size].reshape(self.layers[i], self.layers[i + 1]))
+            offset += size
+            if self.bias:
+                biases.append(buffer[offset:offset + self.layers[i + 1]])
+                offset += self.layers[i + 1]
+        return weights, biases
+
+    def bind_parameters(self, parameters, gradients=None):
+        """
+        Makes the given flat buffer the storage of the model. self.weights and self.biases are views into it,
+        self.D_weights and self.D_biases are views into the gradient buffer (preallocated if not given).
+        """
+        self.parameters = parameters
+        if gradients is None:
+            gradients = np.zeros(parameters.shape, parameters.dtype)
+        self.gradients = gradients
+        self.weights, self.biases = self.layer_views(self.parameters)
+        self.D_weights, self.D_biases = self.layer_views(self.gradients)
+
+    def get_parameters(self):
+        return self.parameters.copy()
+
+    def set_parameters(self, parameters):
+        self.parameters[:] = parameters
+
+    def copy(self):
+        model = copy.copy(self)
+        model.optimizer = copy.deepcopy(self.optimizer)
+        model.bind_parameters(self.parameters.copy())
+        return model
+
+    @staticmethod
+    def average(models):
+        model = models[0].copy()
+        np.mean([m.parameters for m in models], axis=0, out=model.parameters)
+        return model
+
+    def save_parameters(self, path):
+        np.save(path, self.parameters)
+
+    def load_parameters(self, path):
+        self.set_parameters(np.load(path))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('gradients', 'weights', 'biases', 'D_weights', 'D_biases'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bind_parameters(self.parameters)
 
     def feed_forward(self, data):
+        data = np.asarray(data, dtype=self.dtype)
         output = [data]
         z = [data]
         tmp = data
@@ -46,58 +132,135 @@ class MLP:
             tmp = np.dot(tmp, self.weights[i])
             if self.bias:
                 tmp += self.biases[i]
-            z.append(np.array(tmp))
+            z.append(tmp)
             if i < (len(self.weights) - 1):
-                # tmp = np.array([self.activation_function(x) for x in tmp])
-                tmp = np.array(self.activation_function(tmp))
+                tmp = self.activation_function(tmp)
             else:
-                # if self.problem_type == problem_type.Classification:
-                #     tmp = np.array([self.activation_function(x) for x in tmp])
-                # elif self.problem_type == problem_type.Regression:
-                #     tmp = np.array([self.output_function(x) for x in tmp])
-                tmp = np.array(self.output_function(tmp))
+                tmp = self.output_function(tmp)
             output.append(tmp)
         return output, z
 
     def backpropagation(self, outputs, z, result):
-        error = outputs[-1] - np.array(result)
-        D_weights = [np.multiply(np.atleast_2d(
-            error), np.atleast_2d(outputs[-2]).T)]
-        D_biases = [error]
-        tmp = error
-        for layer in range(len(self.weights) - 2, -1, -1):
-            tmp = np.dot(tmp, self.weights[layer+1].T)
-            tmp = np.multiply(
-                tmp, self.activation_function.derivative(z[layer+1]))
-            D_biases.append(tmp[0])
-            tmp1 = np.multiply(tmp, np.atleast_2d(outputs[layer]).T)
-            D_weights.append(tmp1)
-
-        for i in range(len(self.weights)-1, -1, -1):
-            tmp_i = len(self.weights) - i - 1
-            self.weights[tmp_i] -= self.learning_rate * D_weights[i]
+        self.compute_gradients(outputs, z, result)
+        self.apply_gradients()
+
+    def fuses_softmax_cross_entropy(self):
+        return self.loss_function is not None and self.loss_function.__name__ == 'cross_entropy' \
+            and self.output_function.__name__ == 'softmax'
+
+    def output_delta(self, outputs, z, result):
+        """
+        Returns the loss of the batch and its gradient with respect to the pre-activations of the
+        output layer, averaged over the batch. Softmax with cross entropy is computed in one stable step
+        from the logits. Without a loss function the error output - target is propagated.
+        """
+        result = np.asarray(result, dtype=self.dtype)
+        if self.loss_function is None:
+            delta = np.atleast_2d(outputs[-1] - result)
+            delta /= len(delta)
+            return None, delta
+        if self.fuses_softmax_cross_entropy():
+            loss, delta = softmax_cross_entropy(z[-1], result)
+        else:
+            loss, delta = self.loss_function.value_and_gradient(outputs[-1], result)
+            delta = self.output_function.backward(np.atleast_2d(outputs[-1]), delta)
+        return loss, delta.astype(self.dtype, copy=False)
+
+    def compute_gradients(self, outputs, z, result):
+        """
+        Fills the gradient buffer for the batch and returns its loss (None without a loss function).
+        """
+        loss, delta = self.output_delta(outputs, z, result)
+        for layer in range(len(self.weights) - 1, -1, -1):
+            np.dot(np.atleast_2d(outputs[layer]).T, delta, out=self.D_weights[layer])
             if self.bias:
-                self.biases[tmp_i] -= self.learning_rate * D_biases[i]
+                np.sum(delta, axis=0, out=self.D_biases[layer])
+            if layer > 0:
+                delta = np.dot(delta, self.weights[layer].T)
+                self.activation_function.backward(outputs[layer], delta)
+        return loss
+
+    def apply_gradients(self):
+        """
+        Performs the SGD step (or the step of self.optimizer) in place. The gradient buffer is overwritten on the way.
+        """
+        if self.optimizer is not None:
+            self.optimizer.step(self.parameters, self.gradients, self.learning_rate)
+            return
+        self.gradients *= self.learning_rate
+        self.parameters -= self.gradients
+
+    def encode_targets(self, Y, classes_no, category_shift=1):
+        """
+        One hot targets for classification, targets cast to self.dtype for regression, as (n, outputs).
+        """
+        Y = np.asarray(Y)
+        if self.problem_type == problem_type.Classification:
+            Y = np.eye(classes_no, dtype=self.dtype)[Y.astype(int) - category_shift]
+        else:
+            Y = Y.astype(self.dtype)
+        return Y.reshape(len(Y), -1)
+
+    def prepare_training_data(self, dataset, category_shift=1):
+        if isinstance(dataset, PreparedDataset):
+            return dataset.X, dataset.Y
+        X, Y = split_dataset(dataset)
+        X = np.asarray(X, dtype=self.dtype)
+        return X, self.encode_targets(Y, len(np.unique(Y)), category_shift)
+
+    def prepare_dataset(self, dataset, category_shift=1):
+        """
+        Converts the dataset once into a PreparedDataset, which train and test accept
+        and which train reshuffles every epoch without converting it again.
+        """
+        X, labels = split_dataset(dataset)
+        X, Y = self.prepare_training_data((np.asarray(X), labels), category_shift)
+        if self.problem_type == problem_type.Classification:
+            labels = np.asarray(labels).astype(int)
+        return PreparedDataset(X, labels, Y)
+
+    def training_batches(self, dataset, category_shift=1, shuffle=True):
+        """
+        Returns a function giving the batches of one epoch. A DataStream is read batch by batch,
+        a PreparedDataset is reshuffled every epoch, any other dataset is prepared and shuffled once.
+        """
+        if isinstance(dataset, PreparedDataset):
+            return lambda: dataset.batches(self.batch_size, shuffle)
+        if isinstance(dataset, DataStream):
+            transform = lambda X, y: (np.asarray(X, dtype=self.dtype),
+                                      self.encode_targets(y, dataset.classes, category_shift))
+            return lambda: dataset.batches(self.batch_size, transform)
+        X, Y = self.prepare_training_data(dataset, category_shift)
+        if shuffle:
+            permutation = np.random.permutation(len(X))
+            X, Y = X[permutation], Y[permutation]
+        return lambda: ((X[start:start + self.batch_size], Y[start:start + self.batch_size])
+                        for start in range(0, len(X), self.batch_size))
 
     def train(self, dataset, show_percentage=1, category_shift=1, shuffle = True):
         print_flag = show_percentage != -1
         if print_flag:
             print('----START TRAINING----')
         showing_param = 0
-        dataset_tmp = []
-        if self.problem_type == problem_type.Classification:
-            classes_no = len(np.unique([y for _, y in dataset]))
-            for row in dataset:
-                y_tmp = np.zeros(classes_no)
-                y_tmp[int(row[1]) - category_shift] = 1
-                dataset_tmp.append([np.array(row[0]), y_tmp])
-            dataset = dataset_tmp
-        if shuffle:
-            np.random.shuffle(dataset)
+        profiler = self.profiler or NULL_PROFILER
+        with profiler.phase('data'):
+            batches = self.training_batches(dataset, category_shift, shuffle)
+        step = 0
         for i in range(self.epochs):
-            for X, Y in dataset:
-                output, z = self.feed_forward(X)
-                self.backpropagation(output, z, Y)
+            for X, Y in profiler.timed('data', batches()):
+                with profiler.phase('forward'):
+                    output, z = self.feed_forward(X)
+                with profiler.phase('backward'):
+                    self.compute_gradients(output, z, Y)
+                with profiler.phase('update'):
+                    self.apply_gradients()
+                profiler.count(len(X))
+                for callback in self.callbacks:
+                    callback.on_step(self, step, len(X))
+                step += 1
+            self.epoch += 1
+            for callback in self.callbacks:
+                callback.on_epoch_end(self, self.epoch)
             if i/self.epochs >= showing_param/100:
                 if print_flag:
                     print(
@@ -108,6 +271,18 @@ class MLP:
         if print_flag:
             print('----TRAINING FINISHED----')
 
+    def forward(self, data):
+        tmp = np.asarray(data, dtype=self.dtype)
+        for i in range(len(self.weights)):
+            tmp = np.dot(tmp, self.weights[i])
+            if self.bias:
+                tmp += self.biases[i]
+            if i < (len(self.weights) - 1):
+                self.activation_function(tmp, out=tmp)
+            else:
+                self.output_function(tmp, out=tmp)
+        return tmp
+
     def predict(self, data, category_shift=1):
         prediction = self.feed_forward(data)[0][-1]
         if self.problem_type == problem_type.Classification:
@@ -115,41 +290,61 @@ class MLP:
             prediction = np.argmax(prediction) + category_shift
         return prediction
 
-    def predict_list(self, data):
-        result = []
-        for d in data:
-            result.append(self.predict(d))
-        return result
+    def predict_batch(self, data, category_shift=1, raw=False, chunk_size=4096):
+        """
+        Args:
+            data (array): inputs stacked row by row
+            category_shift (int): value added to the predicted class index
+            raw (bool): return the network outputs instead of class labels
+            chunk_size (int): maximal number of rows passed through the network at once
+        """
+        data = np.atleast_2d(np.asarray(data, dtype=self.dtype))
+        outputs = None
+        for start in range(0, len(data), chunk_size):
+            chunk = self.forward(data[start:start + chunk_size])
+            if outputs is None:
+                outputs = np.empty((len(data), chunk.shape[1]), chunk.dtype)
+            outputs[start:start + chunk_size] = chunk
+        if outputs is None:
+            outputs = np.empty((0, self.layers[-1]), self.dtype)
+        if raw or self.problem_type != problem_type.Classification:
+            return outputs
+        return np.argmax(outputs, axis=1) + category_shift
+
+    def predict_list(self, data, category_shift=1):
+        return self.predict_batch(data, category_shift=category_shift)
 
-    def test(self, dataset, show_percentage=1, category_shift=1):
+    def test(self, dataset, show_percentage=1, category_shift=1, chunk_size=4096):
         print_flag = show_percentage != -1
         if print_flag:
             print('----START TEST----')
-        counter = 0
         showing_param = 0
-        len_dataset = len(dataset)
-        targets = []
-        predictions = []
-        for i in range(len_dataset):
-            data, result = dataset[i]
-            prediction = self.predict(data, category_shift=category_shift)
+        profiler = self.profiler or NULL_PROFILER
+        with profiler.phase('evaluation'):
+            inputs, targets = split_dataset(dataset)
+            len_dataset = len(inputs)
+            predictions = []
+            for start in range(0, len_dataset, chunk_size):
+                predictions.append(self.predict_batch(
+                    inputs[start:start + chunk_size], category_shift, chunk_size=chunk_size))
+                if start/len_dataset >= showing_param/100:
+                    if print_flag:
+                        print(
+                            f'Test progress status: {round(start/len_dataset * 100, 2)}%')
+                    showing_param += show_percentage
+            predictions = np.concatenate(predictions)
+            if print_flag:
+                print(f'Test progress status: {100}%')
+                print('----TEST FINISHED----')
+            counter = 0
             if self.problem_type == problem_type.Classification:
-                if prediction == result:
-                    counter += 1
-            targets.append(result)
-            predictions.append(prediction)
-            if i/len_dataset >= showing_param/100:
-                if print_flag:
-                    print(
-                        f'Test progress status: {round(i/len_dataset * 100, 2)}%')
-                showing_param += show_percentage
-        if print_flag:
-            print(f'Test progress status: {100}%')
-            print('----TEST FINISHED----')
-        prediction_rate = counter/len_dataset * 100
-        loss = self.loss_function(predictions, targets)
+                counter = int(np.sum(predictions == targets))
+            prediction_rate = counter/len_dataset * 100
+            loss = self.loss_function(predictions, targets)
         if print_flag:
             if self.problem_type == problem_type.Classification:
                 print(f'Correct predicted rate: {prediction_rate}%')
             print(f'Loss function : {loss}')
+        for callback in self.callbacks:
+            callback.on_evaluation(self, {'accuracy': prediction_rate, 'loss': float(loss)})
         return prediction_rate, loss, predictions
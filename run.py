@@ -1,9 +1,9 @@
 from common.functions import function_type
 from perceptron import MLP
 from common.problem_type import problem_type
+from common.dataset import split_dataset
 from common.reader import normalize, prepare_data
 from common.graphs import generate_classification_graph_for_model, generate_loss_function_graph, generate_regression_graph, generate_classification_graph_of_points
-import numpy as np
 
 # region Parameters
 
@@ -78,29 +78,13 @@ def normalize_dataset(train_dataset, test_dataset):
 
 
 def draw_regression(train_dataset, test_dataset, predictions):
-    x = []
-    y = []
-    for i in range(len(test_dataset)):
-        x.append(test_dataset[i][0])
-        y.append(test_dataset[i][1])
-    tx = []
-    ty = []
-    for i in range(len(train_dataset)):
-        tx.append(train_dataset[i][0])
-        ty.append(train_dataset[i][1])
+    x, y = split_dataset(test_dataset)
+    tx, ty = split_dataset(train_dataset)
     generate_regression_graph((x, y), (x, predictions), (tx, ty))
 
 
 def draw_classification(train_dataset, test_dataset, predictions):
-    points = []
-    train_points = []
-    for i in range(len(test_dataset)):
-        points.append((test_dataset[i][0], predictions[i]))
-    for i in range(len(train_dataset)):
-        train_points.append(
-            (train_dataset[i][0], np.nonzero(train_dataset[i][1])))
-
-    # generate_classification_graph_of_points(points, train_points)
+    # generate_classification_graph_of_points((split_dataset(test_dataset)[0], predictions), split_dataset(train_dataset))
     generate_classification_graph_for_model(
         perceptron, train_dataset, test_dataset)
 
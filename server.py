@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+import numpy as np
+from common.checkpoint import load_checkpoint
+from common.problem_type import problem_type
+
+
+class MicroBatcher:
+    """
+    Collects concurrent prediction requests and runs them through one batched forward pass.
+    A batch is closed when it reaches max_batch_size rows or max_latency seconds after its first request.
+    """
+
+    def __init__(self, model, max_batch_size=256, max_latency=0.002, category_shift=1, history=10000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.category_shift = category_shift
+        self.queue = asyncio.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.requests = 0
+        self.batches = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def predict(self, rows, raw=False):
+        """
+        Args:
+            rows (array): (n, inputs) samples of one request
+        """
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, raw, future))
+        result = await future
+        self.latencies.append(time.perf_counter() - start)
+        self.requests += 1
+        return result
+
+    async def collect(self):
+        batch = [await self.queue.get()]
+        size = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def run(self):
+        while True:
+            # requests whose caller gave up (e.g. a closed connection) are dropped
+            batch = [item for item in await self.collect() if not item[2].done()]
+            if not batch:
+                continue
+            try:
+                await self.process(batch)
+            except Exception as e:
+                # a failing batch only fails its own requests, the batcher keeps serving
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def process(self, batch):
+        inputs = np.concatenate([rows for rows, _, _ in batch])
+        outputs = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.model.predict_batch(inputs, raw=True, chunk_size=len(inputs)))
+        self.batches += 1
+        self.batch_sizes.append(len(inputs))
+        start = 0
+        for rows, raw, future in batch:
+            result = outputs[start:start + len(rows)]
+            start += len(rows)
+            if not raw and self.model.problem_type == problem_type.Classification:
+                result = np.argmax(result, axis=1) + self.category_shift
+            if not future.done():
+                future.set_result(result)
+
+    def metrics(self):
+        latencies = np.array(self.latencies) * 1000
+        batch_sizes = np.array(self.batch_sizes)
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'batch_size_mean': float(batch_sizes.mean()) if len(batch_sizes) else None,
+            'batch_size_max': int(batch_sizes.max()) if len(batch_sizes) else None,
+        }
+
+
+class PredictionServer:
+    """
+    Minimal HTTP/1.1 server: POST /predict with {"inputs": [[...], ...], "raw": false} and GET /metrics.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def respond(self, writer, status, body):
+        encoded = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(encoded)}\r\n\r\n'.encode() + encoded)
+        await writer.drain()
+
+    async def handle_request(self, method, target, body):
+        if method == 'GET' and target == '/metrics':
+            return '200 OK', self.batcher.metrics()
+        if method == 'POST' and target == '/predict':
+            try:
+                request = json.loads(body)
+                rows = np.atleast_2d(np.asarray(request['inputs'], dtype=self.batcher.model.dtype))
+            except (ValueError, KeyError, TypeError) as e:
+                return '400 Bad Request', {'error': str(e)}
+            if rows.ndim != 2 or rows.shape[1] != self.batcher.model.layers[0]:
+                return '400 Bad Request', {'error': f'expected rows of {self.batcher.model.layers[0]} inputs'}
+            predictions = await self.batcher.predict(rows, bool(request.get('raw', False)))
+            return '200 OK', {'predictions': predictions.tolist()}
+        return '404 Not Found', {'error': 'not found'}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, response = await self.handle_request(method, target, body)
+                await self.respond(writer, status, response)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000, unix_path=None):
+        self.batcher.start()
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+            print(f'Serving on {unix_path}')
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f'Serving on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', help='model checkpoint written by common.checkpoint.save_checkpoint')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', default=None, help='serve on a Unix socket instead of TCP')
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-latency-ms', type=float, default=2.0)
+    parser.add_argument('--category-shift', type=int, default=1)
+    args = parser.parse_args()
+
+    model, _, _ = load_checkpoint(args.checkpoint, mmap_mode='r')
+    batcher = MicroBatcher(model, args.max_batch_size, args.max_latency_ms / 1000, args.category_shift)
+    asyncio.run(PredictionServer(batcher).serve(args.host, args.port, args.unix))
@@ -1,3 +1,7 @@
+import argparse
+import copy
+import hashlib
+import json
 import multiprocessing
 import time
 import itertools
@@ -5,8 +9,12 @@ import tqdm
 from common.tests.Test import Test
 from common.functions import function_type
 from perceptron import MLP
+from ensemble import MLPEnsemble
 from common.problem_type import problem_type
-from common.reader import prepare_data
+from common.render_queue import Renderer
+from common.results_store import RESULTS_DB, ResultsStore
+from common.scheduler import CompletedRuns, estimate_cost, schedule, schedule_groups
+from common.shared_datasets import DatasetRegistry, attach_datasets
 import numpy as np
 
 SEED = 12020122
@@ -14,6 +22,20 @@ REPETITIONS = 60 # 60
 EPOCHS = 5 # 5
 ITERATIONS = REPETITIONS * EPOCHS # = 300
 LEARINN_RATE = 0.1
+COMPLETED_RUNS_PATH = 'data/results/completed_runs.txt'
+EVAL_EVERY = 1 # score every repetition
+EVAL_SUBSAMPLE = None # score the whole train set
+PATIENCE = None # no early stopping
+OPTIMIZER = None # plain SGD, or e.g. Adam() from common.optimizers (copied for every test)
+
+# hidden layers of the tested topologies, also used by benchmark.py
+HIDDEN_LAYERS = [[], 
+          [2],  [4,2],   [8,4,2],     [16,8,4,2],
+          [8],  [16,8],  [32,16,8],   [64,32,16,8],
+          [32], [64,32], [128,64,32], [256,128,64,32]]
+
+# every dataset pair of the sweep, loaded once and shared with the pool workers
+DATASETS = DatasetRegistry()
 
 def layer_amount(layers):
     return str(len(layers))
@@ -25,12 +47,12 @@ def dataset_name_amount(dataset_path):
     splited = dataset_path.split('.')
     return f'{splited[1].replace("_","-")}_{splited[3]}'
 
-def get_input_output_dataset(problem_type, dataset_path):
+def get_input_output_dataset(problem_type, dataset_paths):
     if problem_type == problem_type.Regression:
         return (1,1)
     else:
-        dataset = prepare_data(problem_type, dataset_path)
-        len_test_inputs = len(np.unique([y for x, y in dataset]))
+        (_, targets), _ = DATASETS.load(problem_type, dataset_paths[0], dataset_paths[1])
+        len_test_inputs = len(np.unique(targets))
         return (2, len_test_inputs)
 
 def generate_instances():
@@ -41,10 +63,7 @@ def generate_instances():
     #           [1,8,1],  [1,16,8,1],  [1,32,16,8,1],   [1,64,32,16,8,1],
     #           [1,32,1], [1,64,32,1], [1,128,64,32,1], [1,256,128,64,32,1]]
 
-    hidden_layers = [[], 
-              [2],  [4,2],   [8,4,2],     [16,8,4,2],
-              [8],  [16,8],  [32,16,8],   [64,32,16,8],
-              [32], [64,32], [128,64,32], [256,128,64,32]]
+    hidden_layers = HIDDEN_LAYERS
 
     problems  = [problem_type.Classification, problem_type.Regression]
     classification_loss_function = [function_type.Cross_entropy, function_type.Hinge]
@@ -76,10 +95,10 @@ def generate_instances():
     problems_loss_functions_datasets=[]
 
     for r in datasets_classification: #Classification
-        problems_loss_functions_datasets.append((problems[0], classification_loss_function, r, get_input_output_dataset(problems[0],r[0]), output_functions[0]))
+        problems_loss_functions_datasets.append((problems[0], classification_loss_function, r, get_input_output_dataset(problems[0],r), output_functions[0]))
 
     for r in datasets_regression: #Regression
-        problems_loss_functions_datasets.append((problems[1], regression_loss_function, r, get_input_output_dataset(problems[1],r[0]), output_functions[1]))
+        problems_loss_functions_datasets.append((problems[1], regression_loss_function, r, get_input_output_dataset(problems[1],r), output_functions[1]))
     
     
     for r in itertools.product(problems_loss_functions_datasets, hidden_layers, activation_functions, biases):
@@ -87,9 +106,11 @@ def generate_instances():
         layer.insert(0, r[0][3][0])
         layer.append(r[0][3][1])
         # problem_type, layers, activation_function, output_function, loss_function, epochs, learning_rate, seed, bias=False
-        mpl = MLP(r[0][0], layer, r[2], r[0][4], None, EPOCHS, LEARINN_RATE, SEED, r[3])
+        mpl = MLP(r[0][0], layer, r[2], r[0][4], None, EPOCHS, LEARINN_RATE, SEED, r[3],
+                  optimizer=copy.deepcopy(OPTIMIZER))
         # mpl, train_dataset_path, test_dataset_path, loss_function1, loss_function2, n_repetition=1, name="test", seed=None):
         result.append(Test(mpl, r[0][2][0], r[0][2][1], r[0][1][0], r[0][1][1], n_repetition=REPETITIONS, seed=SEED,
+            eval_every=EVAL_EVERY, eval_subsample=EVAL_SUBSAMPLE, patience=PATIENCE,
             name=f'{r[0][0].__name__}_{layer_amount(r[1])}_{nodes_amount(r[1])}_{SEED}_{1 if r[3] else 0}_{r[2].__name__}_{dataset_name_amount(r[0][2][0])}'))
         # Rodzaj probleu - ilośc warst - ilośc nodów - biases - funkcja aktywacji - dataset - licznośc datasetu -(wykres błedu/wynikowy).csv
 
@@ -103,26 +124,163 @@ def generate_instances():
 def run_test(test):
     print(f'start of {test.name}')
     test.start()
+    return test.record(), test.plots
+
+
+def ensemble_key(test):
+    return (test.mpl.problem_type.value, tuple(test.mpl.layers), test.train_dataset_path, test.test_dataset_path,
+            test.mpl.epochs, test.mpl.batch_size, test.mpl.dtype.str, test.n_repetition, test.seed,
+            test.eval_every, test.eval_subsample, test.patience)
+
+
+def group_tests(tests):
+    """
+    Groups tests which can be trained together by MLPEnsemble, keeping the order of the first members.
+    MLPEnsemble trains with plain SGD only, so every test with an optimizer is a group of its own.
+    """
+    groups = {}
+    for test in tests:
+        key = ensemble_key(test) if test.mpl.optimizer is None else id(test)
+        groups.setdefault(key, []).append(test)
+    return list(groups.values())
+
 
+def group_hash(tests):
+    """
+    Hex digest used to shard a group of group_tests, the same on every machine.
+    """
+    if tests[0].mpl.optimizer is not None:
+        return tests[0].config_hash()
+    return hashlib.sha1(json.dumps(ensemble_key(tests[0])).encode()).hexdigest()
 
-def run_tests():
-    iterable = generate_instances()
-    iterable = iterable[200:300] # part 100-200
+
+def run_group(tests):
+    """
+    Runs a group of group_tests, a test with an optimizer alone through run_test.
+    """
+    if tests[0].mpl.optimizer is not None:
+        return [run_test(test) for test in tests]
+    return run_ensemble_test(tests)
+
+
+def run_ensemble_test(tests):
+    """
+    Trains the models of same-topology tests in lockstep. Every test sees the same data order
+    as in Test.start, so its results match a separate run. With early stopping a member is frozen
+    and no longer scored once it asks to stop, and the group stops once every member has stopped.
+    """
+    print(f'start of {len(tests)} tests: {tests[0].name}, ...')
+    np.random.seed(tests[0].seed)
+    for test in tests:
+        test.start_profiling()
+        test.get_data()
+    ensemble = MLPEnsemble([test.mpl for test in tests])
+    results = [[] for _ in tests]
+    predictions = [None for _ in tests]
+    early_stoppings = [test.early_stopping() for test in tests]
+    stopped = [False for _ in tests]
+    for i in range(tests[0].n_repetition):
+        ensemble.train(tests[0].train_dataset)
+        if not tests[0].should_evaluate(i):
+            continue
+        ensemble.store()
+        for j, test in enumerate(tests):
+            if stopped[j]:
+                continue
+            result, predictions[j] = test.evaluate(i)
+            results[j].append(result)
+            if early_stoppings[j] is not None and early_stoppings[j].update(test.tracked_metric(result), i):
+                stopped[j] = True
+                ensemble.freeze(j)
+        if all(stopped):
+            break
+    for test, test_results, test_predictions in zip(tests, results, predictions):
+        test.finish(test_results, test_predictions)
+    return [(test.record(), test.plots) for test in tests]
+
+
+def run_tests(shard=0, shards=1, processes=None, rerun=False, completed_path=COMPLETED_RUNS_PATH, ensemble=False,
+              results_path=RESULTS_DB, render=True):
+    """
+    Args:
+        shard (int): index of this machine's shard, tests are split between machines by config hash
+            (with ensemble, whole groups by group_hash)
+        shards (int): number of machines running the sweep
+        processes (int): number of worker processes, half of the cores by default
+        rerun (bool): also run tests already recorded as completed
+        ensemble (bool): train tests sharing topology, dataset and settings together as one MLPEnsemble
+        results_path (str): SQLite file collecting the results of all tests
+        render (bool): draw the plots in a separate process while training, otherwise they are only
+            stored in common.render_queue.PLOTS_DIR for `python -m common.render_queue`
+    """
+    tests = generate_instances()
+    costs = []
+    for test in tests:
+        (train_inputs, _), (test_inputs, _) = DATASETS.load(
+            test.mpl.problem_type, test.train_dataset_path, test.test_dataset_path, test.mpl.dtype)
+        costs.append(estimate_cost(test, len(train_inputs), len(test_inputs)))
+    completed = CompletedRuns(completed_path)
+    if ensemble:
+        # whole groups are sharded and ordered, so a group is never split between machines
+        test_costs = {id(test): cost for test, cost in zip(tests, costs)}
+        groups = schedule_groups([(group_hash(group), group, [test_costs[id(test)] for test in group])
+                                  for group in group_tests(tests)], None if rerun else completed, shard, shards)
+        print(f'{sum(len(group) for group in groups)} tests in {len(groups)} groups to run in shard {shard}/{shards}')
+    else:
+        iterable = schedule(tests, costs, None if rerun else completed, shard, shards)
+        print(f'{len(iterable)} tests to run in shard {shard}/{shards}')
 
     start_time = time.time()
 
     max_cpu = multiprocessing.cpu_count()
-    p = multiprocessing.Pool(int(max_cpu/2))
-    for _ in tqdm.tqdm(p.imap_unordered(run_test, iterable), total=len(iterable)):
-        pass
-    # p.map_async(run_test, iterable)
+    if processes is None:
+        processes = max(int(max_cpu/2), 1)
+    renderer = Renderer() if render else None
+    # only this process writes, the workers send their results back with the test
+    store = ResultsStore(results_path)
+    # tests are recorded as completed only once their results are committed
+    unflushed = []
+    try:
+        p = multiprocessing.Pool(processes, initializer=attach_datasets, initargs=(DATASETS.share(),))
+        # chunksize=1 keeps the longest-first order of the schedule
+        if ensemble:
+            finished_tests = itertools.chain.from_iterable(
+                tqdm.tqdm(p.imap_unordered(run_group, groups, chunksize=1), total=len(groups)))
+        else:
+            finished_tests = tqdm.tqdm(p.imap_unordered(run_test, iterable, chunksize=1), total=len(iterable))
+        for (config_hash, config, metrics, profile), plots in finished_tests:
+            store.add_run(config_hash, config, metrics, profile)
+            unflushed.append((config_hash, config['name']))
+            if not store.pending_runs:
+                for done_hash, done_name in unflushed:
+                    completed.add(done_hash, done_name)
+                unflushed = []
+            if renderer is not None:
+                renderer.submit(plots)
 
-    p.close()
-    p.join()
+        p.close()
+        p.join()
+    finally:
+        store.close()
+        for done_hash, done_name in unflushed:
+            completed.add(done_hash, done_name)
+        DATASETS.close()
+        if renderer is not None:
+            renderer.close()
 
     print("--- %s seconds ---" % (time.time() - start_time))
 
 
 if __name__ == '__main__':
-    run_tests()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shard', type=int, default=0)
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--rerun', action='store_true')
+    parser.add_argument('--ensemble', action='store_true')
+    parser.add_argument('--no-render', action='store_true', help='only store the plot data')
+    parser.add_argument('--results', default=RESULTS_DB, help='SQLite file collecting the results')
+    args = parser.parse_args()
+    run_tests(args.shard, args.shards, args.processes, args.rerun, ensemble=args.ensemble, results_path=args.results,
+              render=not args.no_render)
     # print(multiprocessing.cpu_count())
\ No newline at end of file
@@ -0,0 +1,42 @@
+import numpy as np
+from common.functions import function_type, softmax_cross_entropy
+
+
+def numerical_gradient(f, x, eps=1e-6):
+    gradient = np.zeros_like(x)
+    for index in np.ndindex(x.shape):
+        step = np.zeros_like(x)
+        step[index] = eps
+        gradient[index] = (f(x + step) - f(x - step)) / (2 * eps)
+    return gradient
+
+
+def test_activation_backward_matches_finite_differences():
+    random = np.random.RandomState(0)
+    x = random.randn(4, 5)
+    weights = random.randn(4, 5)
+    for activation in (function_type.Sigmoid, function_type.Tanh, function_type.Softmax, function_type.Indentity):
+        expected = numerical_gradient(lambda v: np.sum(weights * activation(v)), x)
+        grad = activation.backward(activation(x), weights.copy())
+        assert np.allclose(grad, expected, atol=1e-7), activation.__name__
+
+
+def test_loss_gradients_match_finite_differences():
+    random = np.random.RandomState(1)
+    targets = random.rand(4, 3) + 0.5
+    for predictions in (random.rand(4, 3) + 0.2, random.randn(4, 3)):
+        for loss in (function_type.MSE, function_type.MSLE, function_type.Cross_entropy):
+            if loss is function_type.Cross_entropy and predictions.min() < 0:
+                continue
+            expected = numerical_gradient(lambda p: loss(p, targets), predictions)
+            assert np.allclose(loss.gradient(predictions, targets), expected, atol=1e-6), loss.__name__
+
+
+def test_softmax_cross_entropy_matches_unfused_loss():
+    random = np.random.RandomState(2)
+    logits = random.randn(5, 3)
+    targets = np.eye(3)[random.randint(0, 3, 5)]
+    loss, gradient = softmax_cross_entropy(logits, targets)
+    assert np.isclose(loss, function_type.Cross_entropy(function_type.Softmax(logits), targets))
+    expected = numerical_gradient(lambda x: softmax_cross_entropy(x, targets)[0], logits)
+    assert np.allclose(gradient, expected, atol=1e-7)
@@ -0,0 +1,36 @@
+import numpy as np
+from common.functions import function_type
+from common.problem_type import problem_type
+from common.profiling import Callback, TargetAccuracy
+from perceptron import MLP
+
+
+class Recorder(Callback):
+    def __init__(self):
+        self.events = []
+
+    def on_step(self, model, step, batch_size):
+        self.events.append(('step', step, batch_size))
+
+    def on_epoch_end(self, model, epoch):
+        self.events.append(('epoch', epoch))
+
+    def on_evaluation(self, model, metrics):
+        self.events.append(('evaluation', sorted(metrics)))
+
+
+def test_callbacks_fire_at_step_epoch_and_evaluation():
+    random = np.random.RandomState(0)
+    dataset = (random.randn(10, 2), random.randint(1, 3, 10))
+    model = MLP(problem_type.Classification, [2, 4, 2], function_type.Sigmoid, function_type.Softmax,
+                function_type.Cross_entropy, 2, 0.1, 1, batch_size=4)
+    recorder = Recorder()
+    target = TargetAccuracy(0)
+    model.callbacks += [recorder, target]
+    model.train(dataset, -1)
+    model.test(dataset, -1)
+    steps = [event[1:] for event in recorder.events if event[0] == 'step']
+    assert steps == [(0, 4), (1, 4), (2, 2), (3, 4), (4, 4), (5, 2)]
+    assert [event for event in recorder.events if event[0] == 'epoch'] == [('epoch', 1), ('epoch', 2)]
+    assert recorder.events[-1] == ('evaluation', ['accuracy', 'loss'])
+    assert target.epoch == 2